@@ -0,0 +1,112 @@
+r"""
+encoding_utils 编码转换回归测试
+运行: python -m pytest .\Test\test_encoding_utils.py -v
+
+版本: v1.1.0
+"""
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from encoding_utils import (
+    convert_dict_values, convert_list_values, register_raw_bytes_columns, safe_convert_text,
+)
+
+# 各编码的往返样例：按原编码写入字节，转换后应还原为原文
+ROUND_TRIP_CASES = [
+    ('中文', 'gbk'),
+    ('三体', 'gbk'),
+    ('测试书籍标题', 'gbk'),
+    ('繁體中文', 'big5'),
+    ('三體', 'big5'),
+    ('金庸作品集', 'big5'),
+    ('café', 'latin-1'),
+    ('Müller', 'latin-1'),
+    ('中文书名', 'utf-8'),
+    ('Über', 'utf-8'),
+]
+
+
+@pytest.mark.parametrize('text, encoding', ROUND_TRIP_CASES)
+def test_round_trip_single_value(text, encoding):
+    assert safe_convert_text(text.encode(encoding)) == text
+
+
+@pytest.mark.parametrize('text, encoding', ROUND_TRIP_CASES)
+def test_round_trip_dict(text, encoding):
+    result = convert_dict_values({'title': text.encode(encoding), 'id': 1}, ['title'])
+    assert result == {'title': text, 'id': 1}
+
+
+@pytest.mark.parametrize('text, encoding', ROUND_TRIP_CASES)
+def test_round_trip_list(text, encoding):
+    """单行和多行列表（多行时走抽样检测）都要还原原文"""
+    assert convert_list_values([{'title': text.encode(encoding)}], ['title'])[0]['title'] == text
+    rows = convert_list_values([{'title': text.encode(encoding)} for _ in range(20)], ['title'])
+    assert [row['title'] for row in rows] == [text] * 20
+
+
+def test_gbk_short_value_in_list():
+    """列表中的短GBK字节串不能被统计检测误判"""
+    rows = convert_list_values([{'title': '中文'.encode('gbk')}], ['title'])
+    assert rows[0]['title'] == '中文'
+
+
+def test_latin1_short_bytes_not_utf16():
+    """短latin-1字节串不能被判为UTF-16"""
+    assert safe_convert_text(b'caf\xe9') == 'café'
+
+
+def test_latin1_value_in_list():
+    rows = convert_list_values([{'author': 'Müller'.encode('latin-1')}], ['author'])
+    assert rows[0]['author'] == 'Müller'
+
+
+def test_latin1_single_value_not_gbk():
+    """西文重音字母后接ASCII字母不能被当作GBK双字节"""
+    assert safe_convert_text('Müller'.encode('latin-1')) == 'Müller'
+
+
+def test_latin1_sentence_not_cjk():
+    result = safe_convert_text('Ça va très bien'.encode('latin-1'))
+    assert not any('一' <= ch <= '鿿' for ch in result)
+
+
+def test_gbk_list_matches_single_values():
+    """列表抽样检测的结果必须与逐值转换一致"""
+    titles = ['中文', '中文', '三体', '红楼梦']
+    rows = convert_list_values([{'title': t.encode('gbk')} for t in titles], ['title'])
+    assert [row['title'] for row in rows] == titles
+    assert [safe_convert_text(t.encode('gbk')) for t in titles] == titles
+
+
+def test_convert_list_values_returns_copies():
+    """返回的每行都是新字典，修改结果不影响输入"""
+    src = [{'title': 'abc'}, {'title': '中文'.encode('gbk')}]
+    rows = convert_list_values(src, ['title'])
+    assert rows[0] is not src[0] and rows[1] is not src[1]
+    rows[0]['title'] = 'changed'
+    assert src[0]['title'] == 'abc'
+
+
+def test_convert_list_values_copies_unchanged_rows():
+    """即使行中没有需要转换的值，也不能返回输入字典本身"""
+    src = [{'title': 'abc'}]
+    assert convert_list_values(src, ['title'])[0] is not src[0]
+
+
+def test_raw_bytes_columns_leave_blobs_untouched():
+    """只解码TEXT值：原始字节列按GBK/Big5转换，BLOB列保持原样"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE t (title TEXT, name TEXT, data BLOB)")
+    blob = b'\xff\xfe\x00\x01'
+    conn.execute("INSERT INTO t VALUES (CAST(? AS TEXT), ?, ?)", ('中文'.encode('gbk'), 'abc', blob))
+    register_raw_bytes_columns(conn, ['title'])
+    row = conn.execute("SELECT title, name, data FROM t").fetchone()
+    assert row['title'] == '中文'
+    assert row['name'] == 'abc'
+    assert row['data'] == blob and type(row['data']) is bytes
@@ -3,12 +3,245 @@
 编码转换工具模块
 用于处理Calibre数据库中的GBK编码问题
 """
+import codecs
+import functools
 import logging
-import chardet
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+# 编码检测后端：优先使用C实现的cchardet，其次chardet（requirements中的必装依赖）
+# charset-normalizer对书名这类短字节串误判较多（如把latin-1判为UTF-16），只作为最后的回退
+try:
+    import cchardet as _chardet  # type: ignore
+except ImportError:
+    try:
+        import chardet as _chardet  # type: ignore
+    except ImportError:
+        import charset_normalizer as _chardet  # type: ignore
+
+# 可选依赖：pyarrow用于大批量数据的列式解码
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+except ImportError:
+    pa = None
+    pc = None
 
 logger = logging.getLogger(__name__)
 
-def convert_gbk_to_utf8(text):
+# 乱码特征字符（替换符和方框），一次扫描同时匹配
+_MOJIBAKE_RE = re.compile('[\ufffd\u25a1]')
+
+# surrogateescape解码时无法解码的字节会变成U+DC80-U+DCFF代理字符
+_SURROGATE_RE = re.compile('[%s-%s]' % (chr(0xDC80), chr(0xDCFF)))
+
+# 预先查找编解码器，避免每次调用都经过codecs注册表
+_gbk_decode = codecs.getdecoder('gbk')
+_big5_decode = codecs.getdecoder('big5')
+_latin1_encode = codecs.getencoder('latin-1')
+_utf8_decode = codecs.getdecoder('utf-8')
+
+def _build_fixup_table():
+    """
+    构建乱码修复转换表
+    GBK字节被按cp1252误解码时，0x80-0x9F会变成€、‘等latin-1之外的字符，
+    将其映射回对应的单字节码位，乱码特征字符映射为'?'，使latin-1往返成为可能
+    """
+    table = {}
+    for byte in range(0x80, 0xA0):
+        try:
+            table[ord(bytes([byte]).decode('cp1252'))] = byte
+        except UnicodeDecodeError:
+            continue
+    table[0xFFFD] = ord('?')
+    table[0x25A1] = ord('?')
+    return str.maketrans(table)
+
+_FIXUP_TABLE = _build_fixup_table()
+
+# 超出latin-1范围的字符，存在时说明文本不是单字节误解码的结果
+_NON_LATIN1_RE = re.compile('[^\x00-\xff]')
+
+# 高位字符的连续段；GB2312双字节的首尾字节都是高位，乱码中高位字符成对出现
+_HIGH_RUN_RE = re.compile('[\x80-\xff]+')
+
+# ASCII与中文（CJK标点、扩展A、统一汉字、兼容汉字、全角字符）之外的字符
+_NON_CJK_RE = re.compile('[^\x00-\x7f\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+# 不超过该长度的字节串使用字节区间启发式分类，不调用chardet
+_FAST_CLASSIFY_MAX = 512
+
+# 列表抽样检测：样本少于该字节数或置信度低于阈值时不统一编码，改为逐值转换
+_LIST_DETECT_MIN_BYTES = 64
+_LIST_DETECT_MIN_CONFIDENCE = 0.8
+
+def _detect(data: Union[bytes, bytearray, memoryview]) -> Dict[str, Any]:
+    """
+    检测字节串编码
+    返回与chardet.detect一致的 {'encoding': ..., 'confidence': ...} 结构
+    """
+    if isinstance(data, (memoryview, bytearray)):
+        # cchardet只接受bytes
+        data = bytes(data)
+    detected = _chardet.detect(data)
+    if not detected:
+        return {'encoding': None, 'confidence': 0.0}
+    return {'encoding': detected.get('encoding'), 'confidence': detected.get('confidence') or 0.0}
+
+@functools.lru_cache(maxsize=8192)
+def _convert_str(text: str) -> str:
+    """
+    转换字符串（结果缓存）
+    Calibre元数据中作者、系列、标签大量重复，命中缓存即可跳过乱码检测
+    只有重新解码的结果确实是中文时才替换，含乱码特征字符的正常西文保持原样
+
+    >>> _convert_str('ÖÐÎÄ\ufffd')
+    '中文?'
+    >>> _convert_str('Über □ Straße')
+    'Über □ Straße'
+    >>> _convert_str('Émile Zola \ufffd')
+    'Émile Zola \ufffd'
+    """
+    # 纯ASCII文本不可能是乱码，直接返回（绝大多数书名/作者名走这里）
+    if text.isascii():
+        return text
+    # 检查是否包含乱码特征（如连续的问号或方框）
+    if _MOJIBAKE_RE.search(text) is None:
+        # 看起来已经是正常的UTF-8文本
+        return text
+    # 先用C层的str.translate还原cp1252字符并替换乱码特征字符
+    fixed = text.translate(_FIXUP_TABLE)
+    if _NON_LATIN1_RE.search(fixed) is not None:
+        # 含有latin-1之外的字符，可能是已经是正确的UTF-8
+        return text
+    # 单独出现的高位字符（如Ü、é、ß）是西文重音字母而不是GBK双字节，不做编解码往返
+    for run in _HIGH_RUN_RE.findall(fixed):
+        if len(run) % 2:
+            return text
+    # 将字符串编码为latin-1，然后重新解码
+    gbk_bytes = _latin1_encode(fixed)[0]
+    # 先尝试GBK，再尝试Big5（繁体中文）
+    decoded_text = _try_decode(_gbk_decode, gbk_bytes)
+    if decoded_text is None:
+        decoded_text = _try_decode(_big5_decode, gbk_bytes)
+    if decoded_text is None or _NON_CJK_RE.search(decoded_text) is not None:
+        # 无法完整解码或解码结果不是中文时保留原文，避免把正常的西文文本替换成乱码
+        return text
+    return decoded_text
+
+def _try_decode(decode: Callable[[bytes, str], Tuple[str, int]], data: bytes) -> Optional[str]:
+    """
+    以surrogateescape方式试探解码，避免构造UnicodeDecodeError异常
+    :return: 解码结果；含有无法解码的字节时返回None
+    """
+    decoded = decode(data, 'surrogateescape')[0]
+    if _SURROGATE_RE.search(decoded) is None:
+        return decoded
+    return None
+
+def _decode_bytes(text: bytes, encoding: str) -> str:
+    """按已知编码解码字节串"""
+    lowered = encoding.lower()
+    if 'gb' in lowered:
+        return text.decode(encoding, errors='replace')
+    elif 'big5' in lowered or 'cp950' in lowered:
+        return _big5_decode(text, 'replace')[0]
+    else:
+        # 使用检测到的编码
+        return text.decode(encoding, errors='replace')
+
+def _classify_cjk(data: bytes) -> Optional[str]:
+    """
+    短字节串的快速编码分类，代替chardet
+    依据双字节首/尾字节区间统计GBK与Big5特征：
+    - 首字节0x81-0xFE，尾字节0x40-0x7E或0x80-0xFE才算一个双字节
+    - 尾字节也是高位的双字节为强特征；尾字节落在ASCII区的只是弱特征（西文重音字母后接字母也会如此）
+    - 首字节0x81-0xA0只出现在GBK中；首字节0xA4-0xC6配低位尾字节是Big5常用字区
+    出现孤立的高位字节，或强特征少于弱特征时无法可靠判断（如latin-1的Müller），交给统计检测
+    :return: 'utf-8' / 'gbk' / 'big5'，无法判断时返回None
+    """
+    if _try_decode(_utf8_decode, data) is not None:
+        return 'utf-8'
+    
+    strong = 0
+    weak = 0
+    gbk_hits = 0
+    big5_hits = 0
+    i = 0
+    n = len(data)
+    while i < n:
+        lead = data[i]
+        if lead < 0x80:
+            i += 1
+            continue
+        if lead == 0x80 or lead == 0xFF or i + 1 >= n:
+            return None
+        trail = data[i + 1]
+        if 0x40 <= trail <= 0x7E:
+            weak += 1
+            if 0xA4 <= lead <= 0xC6:
+                big5_hits += 1
+            else:
+                gbk_hits += 1
+        elif 0x80 <= trail <= 0xFE:
+            strong += 1
+            if lead <= 0xA0:
+                gbk_hits += 1
+        else:
+            return None
+        i += 2
+    
+    if strong == 0 or strong < weak:
+        return None
+    
+    candidates = ('big5', 'gbk') if big5_hits > gbk_hits else ('gbk', 'big5')
+    for encoding in candidates:
+        if _try_decode(_big5_decode if encoding == 'big5' else _gbk_decode, data) is not None:
+            return encoding
+    return None
+
+def _convert_bytes(text: bytes) -> str:
+    """转换字节串（不缓存，字节串通常较大且各不相同）"""
+    # 短字节串（书名、作者名）先用区间启发式，比chardet快得多
+    encoding = _classify_cjk(text) if len(text) <= _FAST_CLASSIFY_MAX else None
+    if encoding:
+        return _decode_bytes(text, encoding)
+    
+    # 如果是字节串，先检测编码
+    detected = _detect(text)
+    if detected['encoding']:
+        return _decode_bytes(text, detected['encoding'])
+    else:
+        # 编码检测失败，依次尝试GBK和Big5，都失败时使用GBK的replace模式
+        decoded_text = _try_decode(_gbk_decode, text)
+        if decoded_text is None:
+            decoded_text = _try_decode(_big5_decode, text)
+        if decoded_text is None:
+            decoded_text = _gbk_decode(text, 'replace')[0]
+        return decoded_text
+
+def _convert_str_safe(text: str) -> str:
+    """字符串转换（不做类型检查），异常时返回原始文本"""
+    try:
+        return _convert_str(text)
+    except Exception as e:
+        logger.warning(f"编码转换失败: {e}, 返回原始文本")
+        return text
+
+def _convert_bytes_safe(text: bytes) -> Any:
+    """字节串转换（不做类型检查），空字节串原样返回，异常时返回原始字节串"""
+    if not text:
+        return text
+    try:
+        return _convert_bytes(text)
+    except Exception as e:
+        logger.warning(f"编码转换失败: {e}, 返回原始文本")
+        return text
+
+def convert_gbk_to_utf8(text: Any) -> Any:
     """
     将GBK/Big5编码的文本转换为UTF-8
     支持简体中文(GBK)和繁体中文(Big5)
@@ -17,106 +250,236 @@ def convert_gbk_to_utf8(text):
     if not text:
         return text
     
-    try:
-        # 首先尝试直接作为UTF-8处理
-        if isinstance(text, str):
-            # 检查是否包含乱码特征（如连续的问号或方框）
-            if '�' in text or '□' in text:
-                # 尝试重新解码
-                try:
-                    # 尝试将字符串编码为latin-1，然后解码为GBK
-                    gbk_bytes = text.encode('latin-1')
-                    # 先尝试GBK
-                    try:
-                        decoded_text = gbk_bytes.decode('gbk', errors='strict')
-                        return decoded_text
-                    except UnicodeDecodeError:
-                        # 如果GBK失败，尝试Big5（繁体中文）
-                        try:
-                            decoded_text = gbk_bytes.decode('big5', errors='strict')
-                            return decoded_text
-                        except UnicodeDecodeError:
-                            # 如果都失败，使用replace模式
-                            decoded_text = gbk_bytes.decode('gbk', errors='replace')
-                            return decoded_text
-                except (UnicodeEncodeError, UnicodeDecodeError):
-                    # 如果失败，可能是已经是正确的UTF-8
-                    return text
-            else:
-                # 看起来已经是正常的UTF-8文本
-                return text
-                
-        elif isinstance(text, bytes):
-            # 如果是字节串，先检测编码
-            detected = chardet.detect(text)
-            if detected['encoding']:
-                encoding = detected['encoding'].lower()
-                if 'gb' in encoding:
-                    return text.decode(detected['encoding'], errors='replace')
-                elif 'big5' in encoding or 'cp950' in encoding:
-                    return text.decode('big5', errors='replace')
+    if isinstance(text, str):
+        return _convert_str_safe(text)
+    elif isinstance(text, bytes):
+        return _convert_bytes_safe(text)
+
+# text_factory产生的TEXT值类型，用于和BLOB列返回的普通bytes区分
+# 用type()动态创建：mypyc编译的原生类不能继承bytes
+_RawText = type('_RawText', (bytes,), {'__slots__': ()})
+
+def register_raw_bytes_columns(conn, columns):
+    """
+    让sqlite3连接直接返回指定列的原始字节并在此解码
+    已知为GBK/Big5存储的列不再经过"驱动按UTF-8解码 -> latin-1回编码 -> GBK解码"的往返，
+    这是处理非UTF-8数据库的唯一入口，上游不应再依赖字符串乱码修复
+    注意：text_factory作用于整个连接，其余TEXT值在此按UTF-8解码；BLOB值保持原样
+    :param conn: sqlite3连接
+    :param columns: 存储原始字节的列名
+    """
+    raw_columns = frozenset(columns)
+    # TEXT值以_RawText返回，BLOB值仍是普通bytes，行工厂据此只解码文本
+    conn.text_factory = _RawText
+    
+    def row_factory(cursor, row):
+        values = []
+        for description, value in zip(cursor.description, row):
+            if type(value) is _RawText:
+                value = bytes(value)
+                if description[0] in raw_columns:
+                    value = _convert_bytes_safe(value)
                 else:
-                    # 使用检测到的编码
-                    return text.decode(detected['encoding'], errors='replace')
-            else:
-                # 编码检测失败，依次尝试GBK和Big5
-                try:
-                    return text.decode('gbk', errors='strict')
-                except UnicodeDecodeError:
-                    try:
-                        return text.decode('big5', errors='strict')
-                    except UnicodeDecodeError:
-                        # 如果都失败，使用GBK的replace模式
-                        return text.decode('gbk', errors='replace')
-    except Exception as e:
-        logger.warning(f"编码转换失败: {e}, 返回原始文本")
-        return text
+                    value = _utf8_decode(value, 'replace')[0]
+            values.append(value)
+        return sqlite3.Row(cursor, tuple(values))
+    
+    conn.row_factory = row_factory
+    return conn
 
-def safe_convert_text(text):
+def _convert_none(text: None) -> str:
+    return ""
+
+def _convert_other(text: Any) -> Any:
+    """非精确str/bytes类型（含其子类）的兜底处理"""
+    if isinstance(text, (str, bytes)):
+        return convert_gbk_to_utf8(text)
+    return str(text)
+
+# 按精确类型分派，直接进入对应类型的转换函数，不再重复isinstance检查
+_DISPATCH: Dict[type, Callable[[Any], Any]] = {
+    str: _convert_str_safe,
+    bytes: _convert_bytes_safe,
+    type(None): _convert_none,
+}
+
+def safe_convert_text(text: Any) -> Any:
     """
     安全的文本转换函数
     处理各种边界情况
     """
-    if text is None:
-        return ""
-    
-    if not isinstance(text, (str, bytes)):
-        return str(text)
-    
-    return convert_gbk_to_utf8(text)
+    # 正常的str（纯ASCII或不含乱码特征）直接返回：只有C层检查，
+    # 也不会让评论等一次性长文本挤占_convert_str的结果缓存
+    if type(text) is str and (text.isascii() or _MOJIBAKE_RE.search(text) is None):
+        return text
+    return _DISPATCH.get(type(text), _convert_other)(text)
 
-def convert_dict_values(data_dict, fields_to_convert):
+def convert_dict_values(data_dict, fields_to_convert, inplace=False):
     """
     转换字典中指定字段的编码
     :param data_dict: 要转换的字典
-    :param fields_to_convert: 需要转换的字段列表
-    :return: 转换后的字典
+    :param fields_to_convert: 需要转换的字段列表（或frozenset）
+    :param inplace: 为True时直接修改并返回原字典，不再复制
+    :return: 转换后的字典（inplace为False时总是新字典，修改返回值不会影响原字典）
     """
     if not isinstance(data_dict, dict):
         return data_dict
     
-    result = data_dict.copy()
+    # 预检查：所有字段都缺失、为空或为纯ASCII时无需逐字段转换，只做一次浅复制
     for field in fields_to_convert:
-        if field in result and result[field] is not None:
-            result[field] = safe_convert_text(result[field])
+        value = data_dict.get(field)
+        if value is not None and not (isinstance(value, str) and value.isascii()):
+            break
+    else:
+        return data_dict if inplace else data_dict.copy()
+    
+    if inplace:
+        for field in fields_to_convert:
+            if data_dict.get(field) is not None:
+                data_dict[field] = safe_convert_text(data_dict[field])
+        return data_dict
+    
+    # 一次推导式构建新字典，调用方可传入预先构建的frozenset避免逐行重建
+    fields_set = frozenset(fields_to_convert)
+    return {
+        key: (safe_convert_text(value) if key in fields_set and value is not None else value)
+        for key, value in data_dict.items()
+    }
+
+def _detect_list_encoding(data_list, fields, detect_sample):
+    """
+    对列表中的字节串字段抽样检测一次编码
+    同一列的数据通常编码一致，只检查前detect_sample个非ASCII字节串
+    先用字节区间分类；统计检测只在样本足够长且置信度足够高时采用
+    :return: 检测到的编码，无法确定时返回None（由调用方逐值转换）
+    """
+    samples = []
+    for item in data_list:
+        if not isinstance(item, dict):
+            continue
+        for field in fields:
+            value = item.get(field)
+            if isinstance(value, bytes) and value and not value.isascii():
+                samples.append(value)
+        if len(samples) >= detect_sample:
+            break
+    
+    if not samples:
+        return None
+    
+    sample = b'\n'.join(samples[:detect_sample])
+    encoding = _classify_cjk(sample)
+    if encoding is None:
+        if len(sample) < _LIST_DETECT_MIN_BYTES:
+            return None
+        detected = _detect(sample)
+        if detected['confidence'] < _LIST_DETECT_MIN_CONFIDENCE:
+            return None
+        encoding = detected['encoding']
+    if not encoding:
+        return None
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return None
+    return encoding
+
+def _convert_rows(data_list, fields, convert):
+    """
+    逐行转换字典列表，每行都返回新字典（与convert_dict_values默认行为一致），
+    修改返回值不会影响调用方的原列表；空值和纯ASCII字段跳过转换
+    """
+    result = []
+    append = result.append
+    for item in data_list:
+        if not isinstance(item, dict):
+            append(item)
+            continue
+        converted = dict(item)
+        for field in fields:
+            value = item.get(field)
+            if value is None or (isinstance(value, str) and value.isascii()):
+                continue
+            converted[field] = convert(value)
+        append(converted)
     
     return result
 
-def convert_list_values(data_list, fields_to_convert):
+def _convert_list_fixed_encoding(data_list, fields, encoding):
+    """使用已确定的编码转换列表，字节串不再逐个检测"""
+    def convert(value):
+        if isinstance(value, bytes) and value:
+            return _decode_bytes(value, encoding)
+        return safe_convert_text(value)
+    
+    return _convert_rows(data_list, fields, convert)
+
+def _convert_chunk(chunk, fields, encoding=None):
+    """转换一个分块（在子进程中执行，必须是模块级函数以便pickle）"""
+    if encoding:
+        return _convert_list_fixed_encoding(chunk, fields, encoding)
+    return _convert_rows(chunk, fields, safe_convert_text)
+
+def convert_list_values(data_list, fields_to_convert, detect_sample=32, num_workers=1, chunk_size=512):
     """
     转换列表中字典的指定字段编码
     :param data_list: 包含字典的列表
     :param fields_to_convert: 需要转换的字段列表
+    :param detect_sample: 抽样检测编码的字节串数量，为0时逐个检测
+    :param num_workers: 大于1且列表超过chunk_size时，按块分发到多进程并行转换
+    :param chunk_size: 每个进程任务处理的行数
     :return: 转换后的列表
     """
     if not isinstance(data_list, list):
         return data_list
     
-    result = []
-    for item in data_list:
-        if isinstance(item, dict):
-            result.append(convert_dict_values(item, fields_to_convert))
-        else:
-            result.append(item)
+    # 循环外预先解析字段，减少内层循环的字节码开销
+    fields = tuple(fields_to_convert)
+    
+    encoding = _detect_list_encoding(data_list, fields, detect_sample) if detect_sample > 0 else None
+    
+    # 大批量数据（如整库导出）使用进程池，绕过GIL
+    if num_workers > 1 and len(data_list) > chunk_size:
+        chunks = [data_list[i:i + chunk_size] for i in range(0, len(data_list), chunk_size)]
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            parts = executor.map(_convert_chunk, chunks, repeat(fields), repeat(encoding))
+            return [item for part in parts for item in part]
+    
+    return _convert_chunk(data_list, fields, encoding)
+
+def convert_list_values_arrow(data_list, fields_to_convert):
+    """
+    大批量数据（如整库导出）的列式转换
+    按字段抽出字节串列，在Arrow中一次完成UTF-8校验与解码；
+    列中含非UTF-8数据时该列回退到逐值转换。未安装pyarrow时等同convert_list_values
+    :param data_list: 包含字典的列表
+    :param fields_to_convert: 需要转换的字段列表
+    :return: 转换后的列表
+    """
+    if pa is None or not isinstance(data_list, list):
+        return convert_list_values(data_list, fields_to_convert)
+    
+    rows = [item.copy() if isinstance(item, dict) else item for item in data_list]
+    for field in tuple(fields_to_convert):
+        positions = []
+        column = []
+        for i, item in enumerate(rows):
+            if not isinstance(item, dict):
+                continue
+            value = item.get(field)
+            if isinstance(value, bytes) and value:
+                positions.append(i)
+                column.append(value)
+            elif value is not None:
+                item[field] = safe_convert_text(value)
+        
+        if not column:
+            continue
+        try:
+            decoded = pc.cast(pa.array(column, type=pa.binary()), pa.string()).to_pylist()
+        except pa.ArrowInvalid:
+            decoded = [_convert_bytes_safe(value) for value in column]
+        for i, value in zip(positions, decoded):
+            rows[i][field] = value
     
-    return result
\ No newline at end of file
+    return rows
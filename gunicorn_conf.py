@@ -0,0 +1,31 @@
+"""
+Gunicorn 配置 - Calibre OPDS 服务
+
+用法: gunicorn -c gunicorn_conf.py opds_server:app
+
+- preload_app: 主进程导入应用并完成数据库查找与校验，
+  worker fork后以写时复制方式共享已导入的模块和配置，不必在每个worker中重复加载
+- gthread: 每个worker用线程并发处理请求，封面/书籍下载不会阻塞OPDS目录请求
+- SQLite连接不能跨进程使用，post_fork中丢弃从主进程继承的连接，worker按需重新打开
+- 日志监听线程不随fork继承，每个worker第一次记录日志时自动启动自己的监听线程（见ProcessQueueHandler）
+"""
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('OPDS_HOST', '0.0.0.0')}:{os.environ.get('OPDS_PORT', '5000')}"
+
+# 容器内cpu_count()返回宿主机CPU数，限制了CPU配额时应通过GUNICORN_WORKERS指定
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
+preload_app = True
+
+# worker心跳文件放在内存文件系统，避免容器overlay磁盘IO导致worker被误判超时
+worker_tmp_dir = '/dev/shm'
+
+
+def post_fork(server, worker):
+    """worker启动后重置数据库连接池"""
+    from opds_server import db
+    db.reset_after_fork()
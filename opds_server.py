@@ -5,6 +5,59 @@ Calibre OPDS服务主程序 - 数据库路径修复版本
 专为文石阅读器优化
 
 版本历史:
+- v2.10.9: 作者/系列键集分页按COALESCE(sort, '')排序和比较，排序名为NULL时下一页不再为空
+- v2.10.8: HEAD请求与GET返回相同的头部（只有limit=0才返回计数feed），HEAD与GET共用响应缓存
+- v2.10.7: 统计信息与健康检查书籍数共用一次统计，按数据库修改时间缓存，书库未修改时不再重新统计
+- v2.10.6: 移除整库书名缓存，书名只对当前页的行转换（依赖编码模块的转换缓存），书库修改后不再在每个worker中重扫全表
+- v2.10.5: 书籍详情统一使用feed缓存的内容ETag，书籍修改时间只用于Last-Modified/If-Modified-Since提前返回304
+- v2.10.4: OPDSGenerator缓存改为有界LRU，防止伪造Host头无限占用内存
+- v2.10.3: DB_CREATE_INDEXES默认关闭，默认不再写入metadata.db；显式开启时才单独打开读写连接建索引
+- v2.10.2: 日志监听线程按进程启动，修复Gunicorn preload后worker日志堆积在队列中丢失的问题
+- v2.10.1: 分类导航的书籍数和存在性判断直接查关联表，不再连接books表
+- v2.10.0: 直接运行时默认关闭调试模式（OPDS_DEBUG开启）；新增gunicorn_conf.py，preload_app后在worker中重置连接池
+- v2.9.1: 健康检查与诊断的书籍数缓存30秒，轮询不再每次统计books表
+- v2.9.0: OPDS feed生成时预压缩为gzip/brotli并随缓存保存，按Accept-Encoding返回
+- v2.8.7: 书籍详情去掉无效的空条目分支
+- v2.8.6: 下载文件候选路径改为生成器逐个尝试，命中即停止
+- v2.8.5: 下载路由只对格式名做一次大写转换，扩展名与MIME类型共用同一个格式键
+- v2.8.4: 书籍详情按书籍修改时间输出ETag/Last-Modified，客户端复查时直接返回304
+- v2.8.3: 下载时直接查MIME常量表，不再为取MIME类型创建临时生成器
+- v2.8.2: OPDSGenerator按站点根地址复用，路由不再每次请求新建实例
+- v2.8.1: 分类导航结果以元组缓存并按位置解包，省去逐行dict构造
+- v2.8.0: 作者/系列/标签导航支持after=游标的键集分页，并输出下一页链接
+- v2.7.6: 容器改用Gunicorn gthread工作模式，下载与封面请求并发处理
+- v2.7.5: 下载文件名清理改为预编译正则加translate，扩展名映射复用模块常量
+- v2.7.4: 作者/系列/标签导航按排序索引分页，书籍数改为只对当前页计算的子查询
+- v2.7.3: 导航条目改用预编译模板批量生成，分类名称在缓存前完成编码转换
+- v2.7.2: 数据库修改后立即清空feed与查询缓存，不再保留过期条目
+- v2.7.1: /api/stats合并为一次查询，结果缓存60秒
+- v2.7.0: 支持X-Sendfile/X-Accel-Redirect，由前端代理直接发送书籍与封面文件
+- v2.6.2: 下载时数据库记录的文件存在则直接使用，只在缺失时扫描书籍目录
+- v2.6.1: 封面查找改为单次scandir并按目录修改时间缓存结果
+- v2.6.0: 请求内数据库连接改为从有界连接池借用，请求结束时归还
+- v2.5.0: 作者/系列/标签聚合查询结果按数据库修改时间缓存，导航feed附带Cache-Control
+- v2.4.7: HEAD请求或limit=0时书籍列表只返回总数，不构建条目；响应缓存区分请求方法
+- v2.4.6: 移除只读连接上多余的foreign_keys/journal_mode/synchronous设置
+- v2.4.5: 书籍列表去掉DISTINCT，先按索引取当前页id再按主键取书籍行
+- v2.4.4: 查询语句提取为模块级常量，连接语句缓存扩大到256条
+- v2.4.3: 书名与作者排序名在打开数据库时统一转换并缓存，数据库修改后自动重建
+- v2.4.2: 连接显式使用str文本工厂，编码转换对正常字符串直接返回
+- v2.4.1: 数据库验证结果按文件stat指纹缓存到磁盘，多worker启动时跳过重复验证；仅在新建索引时执行ANALYZE
+- v2.4.0: feed与条目改为直接拼接XML字符串，不再构建ElementTree
+- v2.3.7: 封面以路径对象交给send_file，启用条件请求与一天的浏览器缓存
+- v2.3.6: mmap与页缓存大小可通过环境变量配置，连接打开时记录实际生效值
+- v2.3.5: 文件名清理正则预编译，书名清理移出格式循环
+- v2.3.4: 导航条目与feed的id改为基于路径的uuid5，重启后保持稳定
+- v2.3.3: 书籍列表通过COUNT(*) OVER ()窗口函数同时返回总数，合并为一次查询
+- v2.3.2: 抽取build_book_filter统一构建过滤片段，查询参数改为不可变元组
+- v2.3.1: 作者/系列/标签过滤改为JOIN，书籍与计数查询共用同一FROM/WHERE片段
+- v2.3.0: OPDS响应按(地址, 数据库修改时间)缓存，支持ETag/304
+- v2.2.3: 日志改为QueueHandler异步写入，热路径debug日志按级别跳过格式化
+- v2.2.2: XML一次序列化输出，去掉minidom重新解析；缩进改为OPDS_PRETTY_XML可选
+- v2.2.1: MIME类型和扩展名映射提升为模块级只读常量
+- v2.2.0: 数据库连接改为每线程只读长连接，不再每请求创建和关闭
+- v2.1.7: 启动时为排序/过滤列创建索引并执行ANALYZE，支持EXPLAIN_SQL输出查询计划
+- v2.1.6: 书籍列表批量查询作者/标签/系列/格式，消除每本书4次的N+1查询
 - v2.1.5: 修复按作者/系列/标签过滤时的SQL构建错误 (incomplete input)
 - v2.1.4: 修复数据库路径检测逻辑，解决"unable to open database file"错误
 - v2.1.3: 修复容器环境数据库路径配置，支持绝对路径和相对路径
@@ -13,24 +66,41 @@ Calibre OPDS服务主程序 - 数据库路径修复版本
 - v2.1.0: 修复OPDSE下载URL构建，移除格式重复问题，确保文件名标准化
 - v2.0.0: 函数重构和OPDS结构优化
 
-当前版本: v2.1.5
+当前版本: v2.10.9
 """
-__version__ = "2.1.5"
+__version__ = "2.10.9"
 
 import os
 import sys
+import json
 import sqlite3
 import logging
 import uuid
 import threading
 import re
+import functools
+import hashlib
+import time
+import atexit
+import queue
+import types
+import contextlib
+import gzip
+from collections import OrderedDict
+from pathlib import Path
 from datetime import datetime, timezone
-from flask import Flask, request, jsonify, Response, send_file, g
+from flask import Flask, request, jsonify, Response, send_file, has_request_context, g, has_app_context
 from werkzeug.exceptions import NotFound
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+from werkzeug.http import is_resource_modified
+from xml.sax.saxutils import escape
 from urllib.parse import quote
 
+# 可选依赖：brotli用于feed预压缩，未安装时只提供gzip
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
 # 导入编码转换工具
 from encoding_utils import safe_convert_text, convert_dict_values, convert_list_values
 
@@ -46,6 +116,9 @@ logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
 # 创建格式化器
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
+# 实际输出的处理器，由后台QueueListener线程写入，请求线程只入队
+log_handlers = []
+
 # 文件处理器
 if LOG_FILE:
     try:
@@ -57,7 +130,7 @@ if LOG_FILE:
             encoding='utf-8'
         )
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        log_handlers.append(file_handler)
     except Exception as e:
         print(f"警告: 无法创建日志文件处理器: {e}")
 
@@ -65,7 +138,47 @@ if LOG_FILE:
 if LOG_TO_CONSOLE:
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    log_handlers.append(console_handler)
+
+from logging.handlers import QueueHandler, QueueListener
+
+class ProcessQueueHandler(QueueHandler):
+    """
+    请求线程只把日志记录放入队列，由后台QueueListener线程写出
+    监听线程不会被fork继承：每个进程（包括Gunicorn preload后fork出的worker）第一次记录日志时
+    新建自己的队列并启动监听线程，避免记录堆积在无人消费的队列中
+    """
+    
+    def __init__(self, targets):
+        super().__init__(None)
+        self._targets = targets
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+    
+    def _start_listener(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(-1)
+            self._listener = QueueListener(self.queue, *self._targets, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+    
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start_listener()
+        self.queue.put_nowait(record)
+    
+    def stop(self):
+        """停止本进程的监听线程并写出剩余记录（继承自父进程的监听线程不处理）"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+
+if log_handlers:
+    log_queue_handler = ProcessQueueHandler(log_handlers)
+    logger.addHandler(log_queue_handler)
+    atexit.register(log_queue_handler.stop)
 
 # 默认处理器
 if not logger.handlers:
@@ -74,8 +187,223 @@ if not logger.handlers:
 
 logger.info(f"日志系统初始化完成 - 级别: {LOG_LEVEL}")
 
+# 数据库索引与查询计划配置
+DB_IMMUTABLE = os.environ.get('DB_IMMUTABLE', 'false').lower() == 'true'
+# 默认纯只读；设为true时启动会对metadata.db执行CREATE INDEX/ANALYZE（写入数据库，应在Calibre未运行时开启）
+DB_CREATE_INDEXES = os.environ.get('DB_CREATE_INDEXES', 'false').lower() == 'true'
+EXPLAIN_SQL = os.environ.get('EXPLAIN_SQL', '0') == '1'
+
+# 只读连接的内存映射大小（字节，0为关闭）与页缓存大小（KiB）
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', '65536'))
+
+# 连接池保留的空闲只读连接数
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+
+# 数据库验证结果缓存文件（按stat指纹判断数据库是否变化）
+VALIDATION_CACHE_FILE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'simple-opds', 'validated.json')
+
+# OPDS响应缓存条目数
+FEED_CACHE_SIZE = int(os.environ.get('FEED_CACHE_SIZE', '256'))
+
+# feed预压缩：小于该字节数的响应不压缩（0为关闭预压缩）
+FEED_COMPRESS_MIN_SIZE = int(os.environ.get('FEED_COMPRESS_MIN_SIZE', '1024'))
+
+# 作者/系列/标签导航feed允许客户端缓存的秒数
+NAV_CACHE_MAX_AGE = int(os.environ.get('NAV_CACHE_MAX_AGE', '300'))
+
+# 文件发送交给前端代理：OPDS_USE_XSENDFILE=true时输出X-Sendfile头（Apache/lighttpd），
+# 设置OPDS_ACCEL_REDIRECT_PREFIX时改为nginx的X-Accel-Redirect（前缀对应internal location）
+OPDS_USE_XSENDFILE = os.environ.get('OPDS_USE_XSENDFILE', 'false').lower() == 'true'
+OPDS_ACCEL_REDIRECT_PREFIX = os.environ.get('OPDS_ACCEL_REDIRECT_PREFIX', '').rstrip('/')
+
+# OPDS客户端不需要缩进，默认输出紧凑XML
+OPDS_PRETTY_XML = os.environ.get('OPDS_PRETTY_XML', 'false').lower() == 'true'
+
+# 直接运行 python opds_server.py 时是否启用Flask调试模式（自动重载和交互式调试器，仅限开发）
+OPDS_DEBUG = os.environ.get('OPDS_DEBUG', 'false').lower() == 'true'
+
+# OPDS查询依赖的索引（均为幂等创建）
+BOOK_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_books_last_modified ON books(last_modified DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_authors_name ON authors(name)",
+    "CREATE INDEX IF NOT EXISTS idx_authors_sort ON authors(sort)",
+    "CREATE INDEX IF NOT EXISTS idx_series_sort ON series(sort)",
+    "CREATE INDEX IF NOT EXISTS idx_series_name ON series(name)",
+    # 与分类导航的排序键一致的表达式索引
+    "CREATE INDEX IF NOT EXISTS idx_authors_sort_key ON authors(COALESCE(sort, '') COLLATE NOCASE, id)",
+    "CREATE INDEX IF NOT EXISTS idx_series_sort_key ON series(COALESCE(sort, '') COLLATE NOCASE, id)",
+    "CREATE INDEX IF NOT EXISTS idx_tags_name ON tags(name)",
+    "CREATE INDEX IF NOT EXISTS idx_books_authors_link_book ON books_authors_link(book)",
+    "CREATE INDEX IF NOT EXISTS idx_books_authors_link_author ON books_authors_link(author)",
+    "CREATE INDEX IF NOT EXISTS idx_books_series_link_book ON books_series_link(book)",
+    "CREATE INDEX IF NOT EXISTS idx_books_series_link_series ON books_series_link(series)",
+    "CREATE INDEX IF NOT EXISTS idx_books_tags_link_book ON books_tags_link(book)",
+    "CREATE INDEX IF NOT EXISTS idx_books_tags_link_tag ON books_tags_link(tag)",
+]
+
+# 常用查询语句（模块级常量，保证每次执行的SQL文本完全一致，命中连接的语句缓存）
+SQL_CACHED_STATEMENTS = 256
+
+SQL_BOOK_COLUMNS = """b.id, b.title, b.author_sort, b.path,
+                    b.series_index, b.isbn, b.pubdate, b.last_modified,
+                    b.has_cover, b.uuid"""
+
+SQL_ALL_BOOKS = f"""
+    SELECT {SQL_BOOK_COLUMNS}
+    FROM books b
+    ORDER BY b.last_modified DESC LIMIT ? OFFSET ?
+"""
+
+SQL_SEARCH_BOOKS = f"""
+    SELECT {SQL_BOOK_COLUMNS}
+    FROM books b
+    WHERE (b.title LIKE ? OR b.author_sort LIKE ?)
+    ORDER BY b.last_modified DESC LIMIT ? OFFSET ?
+"""
+
+# 按主键批量取书籍行，{placeholders}为IN列表占位符
+SQL_BOOKS_BY_IDS = f"""
+    SELECT {SQL_BOOK_COLUMNS}
+    FROM books b
+    WHERE b.id IN ({{placeholders}})
+"""
+
+SQL_BOOK_DETAIL = """
+    SELECT b.id, b.title, b.author_sort, b.path, b.series_index,
+            b.isbn, b.pubdate, b.last_modified, b.has_cover,
+            b.uuid, b.flags, b.lccn
+    FROM books b
+    WHERE b.id = ?
+"""
+
+SQL_BOOK_LAST_MODIFIED = "SELECT last_modified FROM books WHERE id = ?"
+
+SQL_BOOK_COMMENTS = "SELECT text FROM comments WHERE book = ?"
+
+SQL_BOOK_AUTHORS = """
+    SELECT a.name, a.sort
+    FROM authors a
+    JOIN books_authors_link bal ON a.id = bal.author
+    WHERE bal.book = ?
+    ORDER BY bal.id
+"""
+
+SQL_BOOK_TAGS = """
+    SELECT t.name
+    FROM tags t
+    JOIN books_tags_link btl ON t.id = btl.tag
+    WHERE btl.book = ?
+    ORDER BY t.name
+"""
+
+SQL_BOOK_SERIES = """
+    SELECT s.name, s.sort, b.series_index
+    FROM series s
+    JOIN books_series_link bsl ON s.id = bsl.series
+    JOIN books b ON bsl.book = b.id
+    WHERE b.id = ?
+"""
+
+SQL_BOOK_FORMATS = """
+    SELECT format, uncompressed_size, name
+    FROM data
+    WHERE book = ?
+    ORDER BY format
+"""
+
+# 统计信息：书籍数、作者数与各格式数量一次查询返回
+SQL_STATS = """
+    SELECT 'books', NULL, COUNT(*) FROM books
+    UNION ALL
+    SELECT 'authors', NULL, COUNT(*) FROM authors
+    UNION ALL
+    SELECT 'format', format, COUNT(*) FROM data GROUP BY format
+"""
+
+# 分类导航：按排序列索引顺序扫描并在LIMIT处停止，书籍数只对输出的行计算，不再对整个连接做GROUP BY
+# Calibre删除书籍时由触发器清理关联表，关联表中的书籍必然存在，计数无需再连接books表
+# {after}为键集分页条件：按(排序列, id)定位到游标之后，深翻页无需扫描并丢弃OFFSET行
+# 作者/系列的sort可能为NULL，行值比较遇到NULL永远不成立，排序和比较统一使用COALESCE(sort, '')
+# （显式指定Calibre建表时声明的NOCASE，函数表达式不会继承列的排序规则）；标签名为NOT NULL
+_SQL_NAV_AUTHORS = """
+    SELECT a.id, a.name,
+           (SELECT COUNT(*) FROM books_authors_link bal
+            WHERE bal.author = a.id) AS book_count
+    FROM authors a
+    WHERE EXISTS (SELECT 1 FROM books_authors_link bal
+                  WHERE bal.author = a.id){after}
+    ORDER BY COALESCE(a.sort, '') COLLATE NOCASE, a.id
+    LIMIT ? OFFSET ?
+"""
+SQL_NAV_AUTHORS = _SQL_NAV_AUTHORS.format(after='')
+SQL_NAV_AUTHORS_AFTER = _SQL_NAV_AUTHORS.format(
+    after="\n      AND (COALESCE(a.sort, '') COLLATE NOCASE, a.id) > ((SELECT COALESCE(sort, '') FROM authors WHERE id = ?), ?)")
+
+_SQL_NAV_SERIES = """
+    SELECT s.id, s.name,
+           (SELECT COUNT(*) FROM books_series_link bsl
+            WHERE bsl.series = s.id) AS book_count
+    FROM series s
+    WHERE EXISTS (SELECT 1 FROM books_series_link bsl
+                  WHERE bsl.series = s.id){after}
+    ORDER BY COALESCE(s.sort, '') COLLATE NOCASE, s.id
+    LIMIT ? OFFSET ?
+"""
+SQL_NAV_SERIES = _SQL_NAV_SERIES.format(after='')
+SQL_NAV_SERIES_AFTER = _SQL_NAV_SERIES.format(
+    after="\n      AND (COALESCE(s.sort, '') COLLATE NOCASE, s.id) > ((SELECT COALESCE(sort, '') FROM series WHERE id = ?), ?)")
+
+_SQL_NAV_TAGS = """
+    SELECT t.id, t.name,
+           (SELECT COUNT(*) FROM books_tags_link btl
+            WHERE btl.tag = t.id) AS book_count
+    FROM tags t
+    WHERE EXISTS (SELECT 1 FROM books_tags_link btl
+                  WHERE btl.tag = t.id){after}
+    ORDER BY t.name, t.id
+    LIMIT ? OFFSET ?
+"""
+SQL_NAV_TAGS = _SQL_NAV_TAGS.format(after='')
+SQL_NAV_TAGS_AFTER = _SQL_NAV_TAGS.format(
+    after="\n      AND (t.name, t.id) > ((SELECT name FROM tags WHERE id = ?), ?)")
+
+# 批量元数据查询模板，{placeholders}为IN列表占位符（同一页大小下文本保持一致）
+SQL_BULK_AUTHORS = """
+    SELECT bal.book, a.name, a.sort
+    FROM authors a
+    JOIN books_authors_link bal ON a.id = bal.author
+    WHERE bal.book IN ({placeholders})
+    ORDER BY bal.book, bal.id
+"""
+
+SQL_BULK_TAGS = """
+    SELECT btl.book, t.name
+    FROM tags t
+    JOIN books_tags_link btl ON t.id = btl.tag
+    WHERE btl.book IN ({placeholders})
+    ORDER BY btl.book, t.name
+"""
+
+SQL_BULK_SERIES = """
+    SELECT bsl.book, s.name, s.sort, b.series_index
+    FROM series s
+    JOIN books_series_link bsl ON s.id = bsl.series
+    JOIN books b ON bsl.book = b.id
+    WHERE bsl.book IN ({placeholders})
+"""
+
+SQL_BULK_FORMATS = """
+    SELECT book, format, uncompressed_size, name
+    FROM data
+    WHERE book IN ({placeholders})
+    ORDER BY book, format
+"""
+
 # --- Flask 应用初始化 ---
 app = Flask(__name__)
+app.config['USE_X_SENDFILE'] = OPDS_USE_XSENDFILE or bool(OPDS_ACCEL_REDIRECT_PREFIX)
 
 # --- Calibre 数据库访问类 ---
 class CalibreDatabase:
@@ -103,6 +431,65 @@ class CalibreDatabase:
             'errors': 0
         }
         self._stats_lock = threading.Lock()
+        # 请求内使用连接池中的只读长连接；请求之外（启动预加载等）每线程持有一个连接
+        self._pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        self._local = threading.local()
+        self._validated = False
+        
+        if DB_CREATE_INDEXES:
+            self._ensure_indexes()
+    
+    def _ensure_indexes(self):
+        """
+        创建OPDS查询所需的索引（仅DB_CREATE_INDEXES=true时调用，数据库只读时跳过）
+        这是本服务唯一的写操作，使用单独的读写连接，完成后立即关闭
+        """
+        if not os.path.exists(self.db_path):
+            return
+        logger.warning(f"DB_CREATE_INDEXES已开启，将在数据库中创建索引: {self.db_path}")
+        try:
+            start = time.monotonic()
+            # mode=rw: 文件不存在时不会新建数据库
+            conn = sqlite3.connect(f"{Path(self.db_path).absolute().as_uri()}?mode=rw", uri=True, timeout=5.0)
+            try:
+                index_count = "SELECT COUNT(*) FROM sqlite_master WHERE type IN ('index', 'table')"
+                before = conn.execute(index_count).fetchone()[0]
+                for statement in BOOK_INDEXES:
+                    conn.execute(statement)
+                # 只在新建了索引时重新统计，避免每次启动都写入数据库（同时改变验证指纹）
+                has_stats = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sqlite_stat1'").fetchone()
+                if conn.execute(index_count).fetchone()[0] != before or not has_stats:
+                    conn.execute("ANALYZE")
+                conn.commit()
+            finally:
+                conn.close()
+            logger.info(f"数据库索引检查完成，耗时 {time.monotonic() - start:.2f} 秒")
+        except sqlite3.Error as e:
+            logger.warning(f"跳过索引创建（数据库可能为只读）: {e}")
+    
+    def explain_query(self, cursor, query, params):
+        """EXPLAIN_SQL=1时记录查询计划，用于确认索引是否生效"""
+        if not EXPLAIN_SQL:
+            return
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            plan = '; '.join(row[-1] for row in cursor.fetchall())
+            logger.info(f"查询计划: {plan}")
+        except sqlite3.Error as e:
+            logger.warning(f"获取查询计划失败: {e}")
+    
+    def get_db_mtime(self):
+        """
+        获取数据库修改时间（纳秒），作为缓存失效依据
+        同时考虑WAL文件，未checkpoint的写入也能让缓存失效
+        """
+        mtime = os.stat(self.db_path).st_mtime_ns
+        try:
+            mtime = max(mtime, os.stat(f"{self.db_path}-wal").st_mtime_ns)
+        except OSError:
+            pass
+        return mtime
     
     def _find_valid_database(self, default_path):
         """查找有效的数据库文件"""
@@ -125,6 +512,34 @@ class CalibreDatabase:
         logger.error(f"❌ 未找到有效数据库文件，使用配置路径: {fallback_path}")
         return fallback_path
     
+    @staticmethod
+    def _db_fingerprint(db_path):
+        """数据库文件的stat指纹，文件被替换或修改后随之变化"""
+        st = os.stat(db_path)
+        return [st.st_ino, st.st_mtime_ns, st.st_size]
+    
+    @staticmethod
+    def _load_validation_cache():
+        try:
+            with open(VALIDATION_CACHE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _save_validation_cache(self, db_path, fingerprint):
+        """记录验证通过的数据库指纹（写入失败不影响服务）"""
+        try:
+            cache = self._load_validation_cache()
+            cache[os.path.abspath(db_path)] = fingerprint
+            os.makedirs(os.path.dirname(VALIDATION_CACHE_FILE), exist_ok=True)
+            tmp_path = f"{VALIDATION_CACHE_FILE}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            # 原子替换，多个worker同时写入也不会产生半截文件
+            os.replace(tmp_path, VALIDATION_CACHE_FILE)
+        except OSError as e:
+            logger.debug(f"写入数据库验证缓存失败: {e}")
+    
     def _validate_database_file(self, db_path):
         """验证数据库文件是否有效"""
         try:
@@ -133,6 +548,12 @@ class CalibreDatabase:
                 logger.debug(f"数据库文件为空: {db_path}")
                 return False
             
+            # 指纹与上次验证通过时一致则直接跳过（其他worker或上次启动已验证）
+            fingerprint = self._db_fingerprint(db_path)
+            if self._load_validation_cache().get(os.path.abspath(db_path)) == fingerprint:
+                logger.debug(f"数据库验证缓存命中: {db_path}")
+                return True
+            
             # 尝试连接并执行基本查询
             conn = sqlite3.connect(db_path, timeout=5.0)
             cursor = conn.cursor()
@@ -151,6 +572,7 @@ class CalibreDatabase:
             conn.close()
             
             logger.debug(f"数据库验证成功: {db_path}, 书籍数量: {book_count}")
+            self._save_validation_cache(db_path, fingerprint)
             return True
             
         except sqlite3.Error as e:
@@ -160,45 +582,94 @@ class CalibreDatabase:
             logger.debug(f"数据库验证异常: {db_path}, 错误: {e}")
             return False
     
+    def _open_connection(self):
+        """打开只读数据库连接并设置读优化PRAGMA"""
+        # 只在进程内首次打开连接时验证数据库文件
+        if not self._validated:
+            if not os.path.exists(self.db_path):
+                logger.error(f"数据库文件不存在: {self.db_path}")
+                raise FileNotFoundError(f"Calibre数据库文件不存在: {self.db_path}")
+            
+            if not self._validate_database_file(self.db_path):
+                logger.error(f"数据库文件无效: {self.db_path}")
+                raise sqlite3.DatabaseError(f"数据库文件损坏或格式错误: {self.db_path}")
+            
+            self._validated = True
+        
+        # immutable=1 会跳过文件锁和变更检测，仅适用于运行期间不会被Calibre修改的库
+        uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+        if DB_IMMUTABLE:
+            uri += "&immutable=1"
+        conn = sqlite3.connect(uri, uri=True, timeout=self.connection_timeout, check_same_thread=False,
+                               cached_statements=SQL_CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        # 文本列统一为str，safe_convert_text对正常字符串走快速路径
+        conn.text_factory = str
+        
+        # page_size由数据库文件决定，只读连接上无法修改，因此不在此设置
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if logger.isEnabledFor(logging.DEBUG):
+            mmap_size = conn.execute("PRAGMA mmap_size").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            logger.debug(f"只读连接已打开 - mmap: {mmap_size} 字节, 页大小: {page_size}, 缓存: {DB_CACHE_SIZE_KB} KiB")
+        
+        return conn
+    
+    def acquire(self):
+        """从连接池借出连接，池中没有空闲连接时新建（不阻塞）"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._open_connection()
+            with self._stats_lock:
+                self._connection_stats['created'] += 1
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"创建数据库连接: {self.db_path}")
+            return conn
+        with self._stats_lock:
+            self._connection_stats['reused'] += 1
+        return conn
+    
+    def release(self, conn):
+        """归还连接，池已满时关闭多余连接"""
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            self.close_connection(conn)
+    
+    @contextlib.contextmanager
+    def connection(self):
+        """借用连接的上下文管理器，退出时自动归还"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
     def get_connection(self):
-        """获取数据库连接 - 每请求模式"""
+        """
+        获取数据库连接 - 连接池模式
+        请求内第一次调用时从池中借出，同一请求复用，请求结束由teardown归还；
+        请求之外使用每线程长连接
+        """
         try:
-            # 预先验证数据库文件
-            if not hasattr(self, '_validated') or not self._validated:
-                if not os.path.exists(self.db_path):
-                    logger.error(f"数据库文件不存在: {self.db_path}")
-                    raise FileNotFoundError(f"Calibre数据库文件不存在: {self.db_path}")
-                
-                # 重新验证数据库文件
-                if not self._validate_database_file(self.db_path):
-                    logger.error(f"数据库文件无效: {self.db_path}")
-                    raise sqlite3.DatabaseError(f"数据库文件损坏或格式错误: {self.db_path}")
-                
-                self._validated = True
+            if has_app_context():
+                conn = g.get('_db_conn')
+                if conn is None:
+                    conn = self.acquire()
+                    g._db_conn = conn
+                return conn
             
-            # 使用Flask g对象管理当前应用上下文的连接
-            if not hasattr(g, 'db_conn'):
-                conn = sqlite3.connect(self.db_path, timeout=self.connection_timeout)
-                conn.row_factory = sqlite3.Row
-                
-                g.db_conn = conn
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._open_connection()
+                self._local.conn = conn
                 with self._stats_lock:
                     self._connection_stats['created'] += 1
-                logger.debug(f"创建数据库连接: {self.db_path}")
-                
-                # 只对可写数据库设置PRAGMA
-                try:
-                    conn.execute("PRAGMA foreign_keys = ON")
-                    conn.execute("PRAGMA journal_mode = WAL")
-                    conn.execute("PRAGMA synchronous = NORMAL")
-                    logger.debug("数据库PRAGMA设置成功")
-                except sqlite3.Error as e:
-                    logger.debug(f"PRAGMA设置跳过（数据库为只读）: {e}")
-            else:
-                with self._stats_lock:
-                    self._connection_stats['reused'] += 1
-            
-            return g.db_conn
+            return conn
             
         except sqlite3.Error as e:
             with self._stats_lock:
@@ -226,12 +697,24 @@ class CalibreDatabase:
         except Exception as e:
             logger.error(f"关闭数据库连接时发生未知错误: {e}")
     
+    def reset_after_fork(self):
+        """
+        在fork出的子进程（Gunicorn worker）中调用，丢弃从父进程继承的连接
+        SQLite连接不能跨进程使用；继承的连接不关闭，避免影响父进程，之后按需重新打开
+        """
+        self._pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        logger.info(f"进程 {os.getpid()} 已重置数据库连接池")
+    
     def get_connection_stats(self):
         """获取连接统计信息"""
         with self._stats_lock:
             stats_copy = self._connection_stats.copy()
         return {
-            'connection_strategy': 'per_request',
+            'connection_strategy': 'pooled',
+            'pool_size': DB_POOL_SIZE,
+            'idle_connections': self._pool.qsize(),
             'stats': stats_copy,
             'database_path': self.db_path,
             'base_books_path': self.base_books_path
@@ -272,42 +755,94 @@ class CalibreDatabase:
         def _get_all_books():
             conn = self.get_connection()
             cursor = conn.cursor()
-            base_query = """
-                SELECT DISTINCT b.id, b.title, b.author_sort, b.path,
-                        b.series_index, b.isbn, b.pubdate, b.last_modified,
-                        b.has_cover, b.uuid
-                FROM books b
-            """
-            conditions = []
-            params = []
             if search:
-                conditions.append("(b.title LIKE ? OR b.author_sort LIKE ?)")
                 search_term = f"%{search}%"
-                params.extend([search_term, search_term])
-            
-            if conditions:
-                base_query += " WHERE " + " AND ".join(conditions)
-            
-            base_query += " ORDER BY b.last_modified DESC LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
-            cursor.execute(base_query, params)
+                cursor.execute(SQL_SEARCH_BOOKS, (search_term, search_term, limit, offset))
+            else:
+                cursor.execute(SQL_ALL_BOOKS, (limit, offset))
             books = cursor.fetchall()
-            book_list = []
-            for book in books:
-                book_dict = dict(book)
-                book_dict['title'] = safe_convert_text(book_dict['title'])
-                book_dict['author_sort'] = safe_convert_text(book_dict['author_sort'])
-                
-                book_dict['authors'] = self.get_book_authors(book['id'])
-                book_dict['tags'] = self.get_book_tags(book['id'])
-                book_dict['series'] = self.get_book_series(book['id'])
-                book_dict['formats'] = self.get_book_formats(book['id'])
-                book_dict['has_cover'] = bool(book['has_cover'])
-                book_list.append(book_dict)
-            return book_list
+            return self.build_book_list(books)
         
         return self.execute_and_log_errors(_get_all_books)
     
+    def _apply_titles(self, book_dict):
+        """
+        转换书名与作者排序名的编码
+        只转换当前页的行；safe_convert_text对纯ASCII/正常文本直接返回，乱码修复结果由编码模块缓存，
+        书库修改后不需要整库重新转换
+        """
+        book_dict['title'] = safe_convert_text(book_dict['title'])
+        book_dict['author_sort'] = safe_convert_text(book_dict['author_sort'])
+    
+    def build_book_list(self, books):
+        """将书籍查询结果转换为字典列表，并批量附加元数据"""
+        metadata = self.get_books_bulk_metadata([book['id'] for book in books])
+        book_list = []
+        for book in books:
+            book_dict = dict(book)
+            self._apply_titles(book_dict)
+            book_dict.update(metadata[book['id']])
+            book_dict['has_cover'] = bool(book['has_cover'])
+            book_list.append(book_dict)
+        return book_list
+    
+    def get_books_by_ids(self, book_ids):
+        """按主键批量获取书籍行，保持book_ids的顺序"""
+        if not book_ids:
+            return []
+        cursor = self.get_connection().cursor()
+        placeholders = ','.join('?' * len(book_ids))
+        cursor.execute(SQL_BOOKS_BY_IDS.format(placeholders=placeholders), book_ids)
+        rows = {row['id']: row for row in cursor.fetchall()}
+        return [rows[book_id] for book_id in book_ids if book_id in rows]
+    
+    def get_books_bulk_metadata(self, book_ids):
+        """
+        批量获取多本书籍的作者、标签、系列和格式信息
+        每类信息一次IN查询，代替逐本书查询（单本详情仍使用get_book_*）
+        :return: {book_id: {'authors': [...], 'tags': [...], 'series': {...}|None, 'formats': [...]}}
+        """
+        def _get_bulk_metadata():
+            metadata = {book_id: {'authors': [], 'tags': [], 'series': None, 'formats': []}
+                        for book_id in book_ids}
+            if not book_ids:
+                return metadata
+            
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            placeholders = ','.join('?' * len(book_ids))
+            
+            cursor.execute(SQL_BULK_AUTHORS.format(placeholders=placeholders), book_ids)
+            for row in cursor.fetchall():
+                metadata[row[0]]['authors'].append({
+                    'name': safe_convert_text(row[1]),
+                    'sort': safe_convert_text(row[2])
+                })
+            
+            cursor.execute(SQL_BULK_TAGS.format(placeholders=placeholders), book_ids)
+            for row in cursor.fetchall():
+                metadata[row[0]]['tags'].append(safe_convert_text(row[1]))
+            
+            cursor.execute(SQL_BULK_SERIES.format(placeholders=placeholders), book_ids)
+            for row in cursor.fetchall():
+                # 与get_book_series一致，每本书只取一个系列
+                if metadata[row[0]]['series'] is None:
+                    metadata[row[0]]['series'] = {
+                        'name': safe_convert_text(row[1]),
+                        'sort': safe_convert_text(row[2]),
+                        'index': row[3]
+                    }
+            
+            cursor.execute(SQL_BULK_FORMATS.format(placeholders=placeholders), book_ids)
+            for row in cursor.fetchall():
+                metadata[row[0]]['formats'].append({
+                    'format': row[1], 'size': row[2], 'filename': row[3]
+                })
+            
+            return metadata
+        
+        return self.execute_and_log_errors(_get_bulk_metadata)
+    
     def get_books_count(self, search=None):
         """获取书籍总数"""
         def _get_books_count():
@@ -332,13 +867,7 @@ class CalibreDatabase:
         def _get_authors():
             conn = self.get_connection()
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT a.name, a.sort
-                FROM authors a
-                JOIN books_authors_link bal ON a.id = bal.author
-                WHERE bal.book = ?
-                ORDER BY bal.id
-            """, (book_id,))
+            cursor.execute(SQL_BOOK_AUTHORS, (book_id,))
             authors = []
             for row in cursor.fetchall():
                 authors.append({
@@ -354,13 +883,7 @@ class CalibreDatabase:
         def _get_tags():
             conn = self.get_connection()
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT t.name
-                FROM tags t
-                JOIN books_tags_link btl ON t.id = btl.tag
-                WHERE btl.book = ?
-                ORDER BY t.name
-            """, (book_id,))
+            cursor.execute(SQL_BOOK_TAGS, (book_id,))
             return [safe_convert_text(row[0]) for row in cursor.fetchall()]
         
         return self.execute_and_log_errors(_get_tags)
@@ -370,13 +893,7 @@ class CalibreDatabase:
         def _get_series():
             conn = self.get_connection()
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT s.name, s.sort, b.series_index
-                FROM series s
-                JOIN books_series_link bsl ON s.id = bsl.series
-                JOIN books b ON bsl.book = b.id
-                WHERE b.id = ?
-            """, (book_id,))
+            cursor.execute(SQL_BOOK_SERIES, (book_id,))
             result = cursor.fetchone()
             if result:
                 return {
@@ -393,12 +910,7 @@ class CalibreDatabase:
         def _get_formats():
             conn = self.get_connection()
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT format, uncompressed_size, name
-                FROM data
-                WHERE book = ?
-                ORDER BY format
-            """, (book_id,))
+            cursor.execute(SQL_BOOK_FORMATS, (book_id,))
             formats = []
             for row in cursor.fetchall():
                 formats.append({
@@ -413,22 +925,15 @@ class CalibreDatabase:
         def _get_book_detail():
             conn = self.get_connection()
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT b.id, b.title, b.author_sort, b.path, b.series_index,
-                        b.isbn, b.pubdate, b.last_modified, b.has_cover,
-                        b.uuid, b.flags, b.lccn
-                FROM books b
-                WHERE b.id = ?
-            """, (book_id,))
+            cursor.execute(SQL_BOOK_DETAIL, (book_id,))
             book = cursor.fetchone()
             if not book:
                 return None
             
             book_dict = dict(book)
-            book_dict['title'] = safe_convert_text(book_dict['title'])
-            book_dict['author_sort'] = safe_convert_text(book_dict['author_sort'])
+            self._apply_titles(book_dict)
             
-            cursor.execute("SELECT text FROM comments WHERE book = ?", (book_id,))
+            cursor.execute(SQL_BOOK_COMMENTS, (book_id,))
             comment_row = cursor.fetchone()
             book_dict['comments'] = safe_convert_text(comment_row[0]) if comment_row else ""
             
@@ -440,298 +945,439 @@ class CalibreDatabase:
             return book_dict
         
         return self.execute_and_log_errors(_get_book_detail)
+    
+    def get_book_last_modified(self, book_id):
+        """
+        获取书籍修改时间（datetime），书籍不存在时返回None
+        时间格式无法解析时退回数据库文件修改时间，保证校验值只会偏保守
+        """
+        def _get_book_last_modified():
+            cursor = self.get_connection().cursor()
+            cursor.execute(SQL_BOOK_LAST_MODIFIED, (book_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            try:
+                modified = datetime.fromisoformat(row[0])
+            except (TypeError, ValueError):
+                return datetime.fromtimestamp(self.get_db_mtime() / 1e9, timezone.utc)
+            return modified if modified.tzinfo else modified.replace(tzinfo=timezone.utc)
+        
+        return self.execute_and_log_errors(_get_book_last_modified)
 
 # --- OPDS XML 生成器 ---
+# 文件格式对应的MIME类型和扩展名（只读常量，避免每次调用重建字典）
+_MIME_TYPES = types.MappingProxyType({
+    'EPUB': 'application/epub+zip', 'PDF': 'application/pdf',
+    'MOBI': 'application/x-mobipocket-ebook', 'AZW3': 'application/vnd.amazon.ebook',
+    'FB2': 'application/x-fictionbook+xml', 'RTF': 'application/rtf',
+    'TXT': 'text/plain', 'HTML': 'text/html', 'LIT': 'application/x-ms-reader'
+})
+_FORMAT_EXT = types.MappingProxyType({
+    'EPUB': '.epub', 'PDF': '.pdf', 'MOBI': '.mobi',
+    'AZW3': '.azw3', 'FB2': '.fb2', 'RTF': '.rtf',
+    'TXT': '.txt', 'HTML': '.html', 'LIT': '.lit'
+})
+# 导航条目与feed id的uuid5命名空间（即uuid.NAMESPACE_URL），按路径生成确定性id
+NAV_NS = uuid.UUID('6ba7b811-9dad-11d1-80b4-00c04fd430c8')
+# 文件名中的路径非法字符
+_UNSAFE_FN_RE = re.compile(r'[<>:"/\\|?*]')
+# 文件名中的空格替换为下划线
+_SPACE_TR = str.maketrans({' ': '_'})
+# 属性值额外需要转义的字符（escape默认只处理 & < >）
+_ATTR_ENTITIES = types.MappingProxyType({'"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#09;'})
+_FEED_TYPE = 'application/atom+xml;type=feed;profile=opds-catalog'
+
+# 导航条目模板（紧凑输出时使用），字段均需预先转义
+_NAV_ENTRY_TPL = ('<entry><title>{title}</title>{summary}<id>urn:uuid:{id}</id>'
+                  '<link rel="http://opds-spec.org/subsection" href="{href}" type="' + _FEED_TYPE + '" /></entry>')
+
+def _text_elem(tag, value):
+    """生成转义后的文本元素"""
+    if value is None or value == '':
+        return f'<{tag} />'
+    return f'<{tag}>{escape(str(value))}</{tag}>'
+
+def _link_elem(rel, href, link_type, title=None, length=None):
+    """生成link元素，属性顺序与原ElementTree输出一致"""
+    parts = [f'<link rel="{escape(rel, _ATTR_ENTITIES)}" href="{escape(href, _ATTR_ENTITIES)}"'
+             f' type="{escape(link_type, _ATTR_ENTITIES)}"']
+    if title is not None:
+        parts.append(f' title="{escape(title, _ATTR_ENTITIES)}"')
+    if length is not None:
+        parts.append(f' length="{length}"')
+    parts.append(' />')
+    return ''.join(parts)
+
 class OPDSGenerator:
     """OPDS XML生成器 - 专为文石阅读器优化"""
     
-    def __init__(self, base_url):
+    def __init__(self, base_url, pretty=OPDS_PRETTY_XML):
         if not base_url:
             raise ValueError("OPDSGenerator必须在路由函数中通过 request.url_root 初始化")
         self.base_url = base_url.rstrip('/')
+        self.pretty = pretty
 
     def create_feed(self, title, entries=None, links=None, feed_info=None):
         """创建OPDS feed"""
-        feed = ET.Element('feed')
-        feed.set('xmlns', 'http://www.w3.org/2005/Atom')
-        feed.set('xmlns:opds', 'http://opds-spec.org/2010/catalog')
-        
-        # 添加基本信息
-        ET.SubElement(feed, 'title').text = title
-        ET.SubElement(feed, 'id').text = f"urn:uuid:{uuid.uuid4()}"
-        ET.SubElement(feed, 'updated').text = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+        # 同一请求路径的feed id保持不变，便于阅读器缓存
+        feed_id = uuid.uuid5(NAV_NS, request.full_path) if has_request_context() else uuid.uuid4()
+        children = [
+            _text_elem('title', title),
+            f'<id>urn:uuid:{feed_id}</id>',
+            f"<updated>{datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')}</updated>",
+        ]
         
         # 添加分页信息
         if feed_info:
             if 'total_results' in feed_info:
-                total_elem = ET.SubElement(feed, 'opds:totalResults')
-                total_elem.text = str(feed_info['total_results'])
+                children.append(f"<opds:totalResults>{feed_info['total_results']}</opds:totalResults>")
             
             if 'start_index' in feed_info:
-                start_elem = ET.SubElement(feed, 'opds:startIndex')
-                start_elem.text = str(feed_info['start_index'])
+                children.append(f"<opds:startIndex>{feed_info['start_index']}</opds:startIndex>")
             
             if 'items_per_page' in feed_info:
-                items_elem = ET.SubElement(feed, 'opds:itemsPerPage')
-                items_elem.text = str(feed_info['items_per_page'])
-        
-        if links is None:
-            links = []
+                children.append(f"<opds:itemsPerPage>{feed_info['items_per_page']}</opds:itemsPerPage>")
         
         # 添加导航链接
-        for link_info in links:
-            link_elem = ET.SubElement(feed, 'link')
-            link_elem.set('rel', link_info.get('rel', 'self'))
-            link_elem.set('href', link_info['href'])
-            link_elem.set('type', link_info.get('type', 'application/atom+xml;type=feed;profile=opds-catalog'))
-            if 'title' in link_info:
-                link_elem.set('title', link_info['title'])
+        for link_info in links or ():
+            children.append(_link_elem(link_info.get('rel', 'self'), link_info['href'],
+                                       link_info.get('type', _FEED_TYPE), link_info.get('title')))
         
         # 添加条目
         if entries:
             for entry in entries:
-                if isinstance(entry, dict):
-                    entry_elem = self.create_entry(entry)
-                else:
-                    entry_elem = entry
-                feed.append(entry_elem)
+                children.append(self.create_entry(entry) if isinstance(entry, dict) else entry)
         
-        return self.prettify_xml(feed)
+        feed = self._wrap('<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opds="http://opds-spec.org/2010/catalog">',
+                          children, '</feed>', 0)
+        return "<?xml version='1.0' encoding='utf-8'?>\n" + feed
     
     def create_entry(self, book_data):
         """创建书籍条目 - 文石优化版本"""
-        entry = ET.Element('entry')
-        
-        ET.SubElement(entry, 'title').text = book_data['title']
+        children = [_text_elem('title', book_data['title'])]
         
         if book_data.get('authors'):
             for author in book_data['authors']:
-                author_elem = ET.SubElement(entry, 'author')
-                ET.SubElement(author_elem, 'name').text = author['name']
+                children.append(f"<author>{_text_elem('name', author['name'])}</author>")
         
         if book_data.get('comments'):
-            summary = ET.SubElement(entry, 'summary')
-            summary.text = book_data['comments']
+            children.append(_text_elem('summary', book_data['comments']))
         
-        ET.SubElement(entry, 'id').text = f"urn:uuid:{book_data.get('uuid', uuid.uuid4())}"
+        children.append(_text_elem('id', f"urn:uuid:{book_data.get('uuid', uuid.uuid4())}"))
         
         # 封面链接
         if book_data.get('has_cover'):
-            cover_link = ET.SubElement(entry, 'link')
-            cover_link.set('rel', 'http://opds-spec.org/image')
-            cover_link.set('href', f"{self.base_url}/opds/cover/{book_data['id']}")
-            cover_link.set('type', 'image/jpeg')
+            children.append(_link_elem('http://opds-spec.org/image',
+                                       f"{self.base_url}/opds/cover/{book_data['id']}", 'image/jpeg'))
         
         # 直接下载链接 - 主要交互方式
         if book_data.get('formats'):
             for fmt in book_data['formats']:
-                download_link = ET.SubElement(entry, 'link')
-                
                 # 第一个格式作为主要下载链接
                 if fmt == book_data['formats'][0]:
-                    download_link.set('rel', 'http://opds-spec.org/acquisition/open-access')
+                    rel = 'http://opds-spec.org/acquisition/open-access'
                 else:
-                    download_link.set('rel', 'http://opds-spec.org/acquisition')
-                
-                # 关键修正：使用书名构建下载文件名，只包含书名和扩展名
-                book_title = book_data['title']
-                
-                # 只使用书名作为基础文件名，不包含格式名
-                # 例如: 《三体》.epub
-                filename_base = book_title
-                
-                # 确保文件名安全，但保留中文
-                # 放宽清理规则，只移除路径非法字符
-                safe_filename = re.sub(r'[<>:"/\\|?*]', '', filename_base)
-                safe_filename = safe_filename.replace(' ', '_')
+                    rel = 'http://opds-spec.org/acquisition'
                 
-                # 确保有扩展名（强制小写）
-                format_extension_map = {
-                    'EPUB': '.epub', 'PDF': '.pdf', 'MOBI': '.mobi',
-                    'AZW3': '.azw3', 'FB2': '.fb2', 'RTF': '.rtf',
-                    'TXT': '.txt', 'HTML': '.html', 'LIT': '.lit'
-                }
-                ext = format_extension_map.get(fmt['format'].upper(), '.epub')  # 默认使用小写
-                if ext and not safe_filename.lower().endswith(ext.lower()):
-                    safe_filename += ext
-                
-                download_link.set('href', f"{self.base_url}/download/{book_data['id']}/{fmt['format']}")
-                download_link.set('type', self.get_mime_type(fmt['format']))
-                download_link.set('title', f"下载 {fmt['format']}")
-                if fmt.get('size'):
-                    download_link.set('length', str(fmt['size']))
+                children.append(_link_elem(rel,
+                                           f"{self.base_url}/download/{book_data['id']}/{fmt['format']}",
+                                           self.get_mime_type(fmt['format']),
+                                           f"下载 {fmt['format']}",
+                                           fmt['size'] if fmt.get('size') else None))
         
-        return entry
+        return self._wrap('<entry>', children, '</entry>', 1)
+    
+    def create_navigation_entries(self, items):
+        """
+        批量创建导航条目
+        :param items: 可迭代的 (title, href, description) 元组
+        """
+        if self.pretty:
+            return [self.create_navigation_entry(*item) for item in items]
+        base_url = self.base_url
+        return [
+            _NAV_ENTRY_TPL.format(
+                title=escape(title),
+                summary=f'<summary>{escape(description)}</summary>' if description else '',
+                id=uuid.uuid5(NAV_NS, href),
+                href=escape(f"{base_url}{href}" if href.startswith('/') else href, _ATTR_ENTITIES),
+            )
+            for title, href, description in items
+        ]
     
     def create_navigation_entry(self, title, href, description=""):
         """创建导航条目"""
-        entry = ET.Element('entry')
-        ET.SubElement(entry, 'title').text = title
+        children = [_text_elem('title', title)]
         if description:
-            ET.SubElement(entry, 'summary').text = description
-        ET.SubElement(entry, 'id').text = f"urn:uuid:{hash(title)}"
-        link = ET.SubElement(entry, 'link')
-        link.set('rel', 'http://opds-spec.org/subsection')
-        link.set('href', f"{self.base_url}{href}" if href.startswith('/') else href)
-        link.set('type', 'application/atom+xml;type=feed;profile=opds-catalog')
-        return entry
+            children.append(_text_elem('summary', description))
+        children.append(f'<id>urn:uuid:{uuid.uuid5(NAV_NS, href)}</id>')
+        children.append(_link_elem('http://opds-spec.org/subsection',
+                                   f"{self.base_url}{href}" if href.startswith('/') else href,
+                                   _FEED_TYPE))
+        return self._wrap('<entry>', children, '</entry>', 1)
     
     def get_mime_type(self, format_name):
         """获取文件格式的MIME类型"""
-        mime_types = {
-            'EPUB': 'application/epub+zip', 'PDF': 'application/pdf',
-            'MOBI': 'application/x-mobipocket-ebook', 'AZW3': 'application/vnd.amazon.ebook',
-            'FB2': 'application/x-fictionbook+xml', 'RTF': 'application/rtf',
-            'TXT': 'text/plain', 'HTML': 'text/html', 'LIT': 'application/x-ms-reader'
-        }
-        return mime_types.get(format_name.upper(), 'application/octet-stream')
+        return _MIME_TYPES.get(format_name.upper(), 'application/octet-stream')
+    
+    def _wrap(self, open_tag, children, close_tag, depth):
+        """拼接子元素；pretty模式下按层级缩进，否则输出紧凑XML"""
+        if not self.pretty:
+            return open_tag + ''.join(children) + close_tag
+        indent = '\n' + '  ' * (depth + 1)
+        return open_tag + ''.join(indent + child for child in children) + '\n' + '  ' * depth + close_tag
+
+# --- 响应缓存 ---
+class LRUCache:
+    """线程安全的LRU缓存"""
     
-    def prettify_xml(self, elem):
-        """格式化XML输出"""
-        rough_string = ET.tostring(elem, 'utf-8')
-        reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="  ", encoding='utf-8').decode('utf-8')
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+feed_cache = LRUCache(maxsize=FEED_CACHE_SIZE)
+# 分类聚合查询结果缓存，与请求的主机名无关，不同访问地址共用
+query_cache = LRUCache(maxsize=128)
+
+_cache_mtime = None
+
+def current_db_mtime():
+    """
+    获取数据库修改时间作为缓存键
+    发现数据库已修改时清空所有缓存，旧版本的feed不会继续占用LRU空间
+    """
+    global _cache_mtime
+    mtime = db.get_db_mtime()
+    if mtime != _cache_mtime:
+        if _cache_mtime is not None:
+            feed_cache.clear()
+            query_cache.clear()
+            logger.info("检测到数据库已修改，已清空OPDS缓存")
+        _cache_mtime = mtime
+    return mtime
+
+def cached_query(name, params, func):
+    """按(查询名, 参数, 数据库修改时间)缓存查询结果，命中时跳过GROUP BY扫描"""
+    key = (name, params, current_db_mtime())
+    result = query_cache.get(key)
+    if result is None:
+        result = db.execute_and_log_errors(func)
+        query_cache.set(key, result)
+    return result
+
+def compress_feed(body):
+    """
+    预压缩feed正文，返回 {Content-Encoding: 压缩后正文}
+    压缩只在生成时做一次，之后的缓存命中直接返回对应编码的字节
+    """
+    if not FEED_COMPRESS_MIN_SIZE or len(body) < FEED_COMPRESS_MIN_SIZE:
+        return {}
+    encoded = {'gzip': gzip.compress(body, 6)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(body, quality=4)
+    return encoded
+
+def cached_feed(view=None, *, max_age=None):
+    """
+    缓存OPDS路由生成的XML（同时缓存gzip/brotli预压缩版本，按Accept-Encoding选择）
+    键包含数据库修改时间，Calibre修改书库后自动失效；客户端携带匹配的If-None-Match时返回304
+    :param max_age: 设置后附带 Cache-Control: public, max-age=...
+    """
+    if view is None:
+        return functools.partial(cached_feed, max_age=max_age)
+    
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            # HEAD按GET处理（由Werkzeug去掉正文），与GET共用缓存，头部保持一致
+            key = (request.url_root, request.full_path, current_db_mtime())
+        except OSError:
+            return view(*args, **kwargs)
+        
+        cached = feed_cache.get(key)
+        if cached is None:
+            response = view(*args, **kwargs)
+            if not isinstance(response, Response) or response.status_code != 200:
+                return response
+            body = response.get_data()
+            etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+            cached = (etag, body, response.headers['Content-Type'], compress_feed(body))
+            feed_cache.set(key, cached)
+        
+        etag, body, content_type, encoded = cached
+        encoding = request.accept_encodings.best_match(encoded) if encoded else None
+        if encoding:
+            # 不同编码的正文不同，强ETag需要区分
+            body = encoded[encoding]
+            etag = f"{etag}-{encoding}"
+        response = Response(body, content_type=content_type)
+        if encoding:
+            response.content_encoding = encoding
+        if encoded:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        if max_age:
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+        return response.make_conditional(request)
+    
+    return wrapper
 
 # --- 实例化对象 ---
 db = CalibreDatabase()
 
-# --- SQLite 连接管理 ---
 @app.teardown_appcontext
-def close_db_connection(exception):
-    """在应用上下文结束时关闭数据库连接"""
-    try:
-        db_conn = g.pop('db_conn', None)
-        if db_conn is not None:
-            db.close_connection(db_conn)
-            logger.debug(f"应用上下文结束，关闭数据库连接")
-    except Exception as e:
-        logger.error(f"应用上下文结束时关闭连接失败: {e}")
+def release_db_connection(exc):
+    """请求结束时把借出的连接归还连接池"""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        db.release(conn)
+
+# 生成器不持有请求状态，按根地址缓存（通常只有一个根地址）
+# 根地址来自客户端可控的Host头，缓存必须有上限
+@functools.lru_cache(maxsize=16)
+def _opds_for_root(root):
+    return OPDSGenerator(base_url=root)
+
+def get_opds():
+    """返回当前请求根地址对应的OPDSGenerator"""
+    return _opds_for_root(request.url_root.rstrip('/'))
 
 # --- OPDS 路由定义 ---
 @app.route('/opds')
+@cached_feed
 def opds_root():
     """OPDS根目录"""
-    opds = OPDSGenerator(base_url=request.url_root.rstrip('/'))
-    entries = []
-    entries.append(opds.create_navigation_entry('最新书籍','/opds/books','按最近添加或修改的时间排序'))
-    entries.append(opds.create_navigation_entry('按作者浏览','/opds/authors','按作者分类的书籍'))
-    entries.append(opds.create_navigation_entry('按系列浏览','/opds/series','按系列分类的书籍'))
-    entries.append(opds.create_navigation_entry('按标签浏览','/opds/tags','按标签分类的书籍'))
+    opds = get_opds()
+    entries = opds.create_navigation_entries([
+        ('最新书籍', '/opds/books', '按最近添加或修改的时间排序'),
+        ('按作者浏览', '/opds/authors', '按作者分类的书籍'),
+        ('按系列浏览', '/opds/series', '按系列分类的书籍'),
+        ('按标签浏览', '/opds/tags', '按标签分类的书籍'),
+    ])
     xml_content = opds.create_feed('Calibre OPDS 目录', entries)
     return Response(xml_content, mimetype='application/atom+xml;charset=utf-8')
 
-@app.route('/opds/books')
-def opds_books():
-    """OPDS书籍列表 - 支持搜索和分类过滤"""
-    search = request.args.get('search')
-    author = request.args.get('author')
-    series = request.args.get('series')
-    tag = request.args.get('tag')
-    limit = min(int(request.args.get('limit', 20)), 100)
-    offset = int(request.args.get('offset', 0))
+def build_book_filter(args):
+    """根据请求参数构建书籍过滤片段
     
-    # 构建过滤条件
+    返回 (FROM/JOIN/WHERE片段, 参数元组)，供书籍查询与计数查询共用。
+    分类过滤使用JOIN，让查询规划器以选择性高的过滤条件驱动外层循环。
+    """
+    joins = []
     filters = []
     params = []
     
+    search = args.get('search')
     if search:
         filters.append("(b.title LIKE ? OR b.author_sort LIKE ?)")
         search_term = f"%{search}%"
         params.extend([search_term, search_term])
     
+    author = args.get('author')
     if author:
-        filters.append("EXISTS (SELECT 1 FROM books_authors_link bal JOIN authors a ON bal.author = a.id WHERE bal.book = b.id AND a.name = ?)")
+        joins.append("JOIN books_authors_link bal ON bal.book = b.id JOIN authors a ON a.id = bal.author")
+        filters.append("a.name = ?")
         params.append(author)
     
+    series = args.get('series')
     if series:
-        filters.append("EXISTS (SELECT 1 FROM books_series_link bsl JOIN series s ON bsl.series = s.id WHERE bsl.book = b.id AND s.name = ?)")
+        joins.append("JOIN books_series_link bsl ON bsl.book = b.id JOIN series s ON s.id = bsl.series")
+        filters.append("s.name = ?")
         params.append(series)
     
+    tag = args.get('tag')
     if tag:
-        filters.append("EXISTS (SELECT 1 FROM books_tags_link btl JOIN tags t ON btl.tag = t.id WHERE btl.book = b.id AND t.name = ?)")
+        joins.append("JOIN books_tags_link btl ON btl.book = b.id JOIN tags t ON t.id = btl.tag")
+        filters.append("t.name = ?")
         params.append(tag)
     
-    # 获取过滤后的书籍
+    from_clause = " ".join(["FROM books b"] + joins)
+    if filters:
+        from_clause += " WHERE " + " AND ".join(filters)
+    return from_clause, tuple(params)
+
+@app.route('/opds/books')
+@cached_feed
+def opds_books():
+    """OPDS书籍列表 - 支持搜索和分类过滤"""
+    search = request.args.get('search')
+    author = request.args.get('author')
+    series = request.args.get('series')
+    tag = request.args.get('tag')
+    limit = min(int(request.args.get('limit', 20)), 100)
+    offset = int(request.args.get('offset', 0))
+    
+    from_clause, params = build_book_filter(request.args)
+    
+    def _count_filtered_books():
+        cursor = db.get_connection().cursor()
+        cursor.execute(f"SELECT COUNT(*) {from_clause}", params)
+        return cursor.fetchone()[0]
+    
+    # 获取过滤后的书籍及总数
+    # 名称在authors/series/tags中唯一、链接表(book, x)唯一，JOIN不会产生重复行，
+    # 因此无需DISTINCT，窗口函数COUNT(*) OVER ()即为总数
     def _get_filtered_books():
         conn = db.get_connection()
         cursor = conn.cursor()
         
-        base_query = """
-            SELECT DISTINCT b.id, b.title, b.author_sort, b.path,
-                    b.series_index, b.isbn, b.pubdate, b.last_modified,
-                    b.has_cover, b.uuid
-            FROM books b
+        # 第一步只按last_modified索引取当前页的id，第二步再按主键取完整行
+        id_query = f"""
+            SELECT b.id, COUNT(*) OVER () AS _total
+            {from_clause}
+            ORDER BY b.last_modified DESC LIMIT ? OFFSET ?
         """
-        
-        if filters:
-            base_query += " WHERE " + " AND ".join(filters)
-        
-        base_query += " ORDER BY b.last_modified DESC LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
-        
-        cursor.execute(base_query, params)
-        books = cursor.fetchall()
-        
-        book_list = []
-        for book in books:
-            book_dict = dict(book)
-            book_dict['title'] = safe_convert_text(book_dict['title'])
-            book_dict['author_sort'] = safe_convert_text(book_dict['author_sort'])
-            
-            book_dict['authors'] = db.get_book_authors(book['id'])
-            book_dict['tags'] = db.get_book_tags(book['id'])
-            book_dict['series'] = db.get_book_series(book['id'])
-            book_dict['formats'] = db.get_book_formats(book['id'])
-            book_dict['has_cover'] = bool(book['has_cover'])
-            book_list.append(book_dict)
-        return book_list
-    
-    def _get_filtered_count():
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        count_query = "SELECT COUNT(DISTINCT b.id) FROM books b"
-        count_params = []
-        
-        if filters:
-            # 对于COUNT查询，需要调整WHERE子句
-            if search:
-                count_query += " WHERE (b.title LIKE ? OR b.author_sort LIKE ?)"
-                count_params.extend([f"%{search}%", f"%{search}%"])
-            
-            if author:
-                if not search:
-                    count_query += " WHERE EXISTS (SELECT 1 FROM books_authors_link bal JOIN authors a ON bal.author = a.id WHERE bal.book = b.id AND a.name = ?)"
-                else:
-                    count_query += " AND EXISTS (SELECT 1 FROM books_authors_link bal JOIN authors a ON bal.author = a.id WHERE bal.book = b.id AND a.name = ?)"
-                count_params.append(author)
-            
-            if series:
-                if not search and not author:
-                    count_query += " WHERE"
-                else:
-                    count_query += " AND"
-                count_query += " EXISTS (SELECT 1 FROM books_series_link bsl JOIN series s ON bsl.series = s.id WHERE bsl.book = b.id AND s.name = ?)"
-                count_params.append(series)
-            
-            if tag:
-                if not search and not author and not series:
-                    count_query += " WHERE"
-                else:
-                    count_query += " AND"
-                count_query += " EXISTS (SELECT 1 FROM books_tags_link btl JOIN tags t ON btl.tag = t.id WHERE btl.book = b.id AND t.name = ?)"
-                count_params.append(tag)
+        query_params = params + (limit, offset)
+        
+        db.explain_query(cursor, id_query, query_params)
+        cursor.execute(id_query, query_params)
+        id_rows = cursor.fetchall()
+        books = db.get_books_by_ids([row['id'] for row in id_rows])
+        
+        if id_rows:
+            total = id_rows[0]['_total']
+        elif offset > 0:
+            # 偏移超出范围时没有行可携带总数，单独计数
+            total = _count_filtered_books()
         else:
-            count_params = []
+            total = 0
         
-        cursor.execute(count_query, count_params)
-        return cursor.fetchone()[0]
+        return db.build_book_list(books), total
     
     try:
-        books = db.execute_and_log_errors(_get_filtered_books)
-        total_books = db.execute_and_log_errors(_get_filtered_count)
-        
-        opds = OPDSGenerator(base_url=request.url_root.rstrip('/'))
+        # limit=0的分页探测只需要opds:totalResults，跳过书籍与元数据查询
+        if limit == 0:
+            total_books = db.execute_and_log_errors(_count_filtered_books)
+            opds = get_opds()
+            links = [{'rel': 'self', 'href': request.url}]
+            feed_info = {'total_results': total_books, 'start_index': offset, 'items_per_page': limit}
+            xml_content = opds.create_feed('书籍总数', links=links, feed_info=feed_info)
+            return Response(xml_content, mimetype='application/atom+xml;charset=utf-8')
+        
+        books, total_books = db.execute_and_log_errors(_get_filtered_books)
+        
+        opds = get_opds()
         base_url = f"{request.url_root.rstrip('/')}/opds/books"
         
         # 构建查询参数
@@ -802,141 +1448,145 @@ def opds_books():
         logger.error(f"获取书籍列表失败: {e}")
         return NotFound()
 
-@app.route('/opds/authors')
-def opds_authors():
-    """按作者分类的OPDS列表"""
-    limit = min(int(request.args.get('limit', 50)), 100)
+def taxonomy_feed(kind, queries, filter_key, label):
+    """
+    作者/系列/标签导航feed
+    支持 offset 分页，以及 after=<上一页最后一项id> 的键集分页；下一页链接统一使用after
+    :param queries: (offset分页SQL, 键集分页SQL)
+    """
+    limit = max(1, min(int(request.args.get('limit', 50)), 100))
     offset = int(request.args.get('offset', 0))
+    after = request.args.get('after', type=int)
     
-    def _get_authors():
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT DISTINCT a.name, a.sort, COUNT(b.id) as book_count
-            FROM authors a
-            JOIN books_authors_link bal ON a.id = bal.author
-            JOIN books b ON bal.book = b.id
-            GROUP BY a.id, a.name, a.sort
-            ORDER BY a.sort
-            LIMIT ? OFFSET ?
-        """, (limit, offset))
-        return [dict(row) for row in cursor.fetchall()]
+    def _get_items():
+        cursor = db.get_connection().cursor()
+        if after is None:
+            cursor.execute(queries[0], (limit, offset))
+        else:
+            cursor.execute(queries[1], (after, after, limit, 0))
+        # 名称在缓存前完成编码转换，缓存命中时无需重复转换；按位置取列，不构造dict
+        return [(row[0], safe_convert_text(row[1]), row[2]) for row in cursor.fetchall()]
     
     try:
-        authors = db.execute_and_log_errors(_get_authors)
-        
-        opds = OPDSGenerator(base_url=request.url_root.rstrip('/'))
-        entries = []
+        items = cached_query(kind, (limit, offset, after), _get_items)
+        
+        opds = get_opds()
+        entries = opds.create_navigation_entries(
+            (f"{name} ({book_count} 本书)",
+             f"/opds/books?{filter_key}={quote(name)}",
+             f"{label}: {name}")
+            for _, name, book_count in items
+        )
         
-        for author in authors:
-            safe_name = safe_convert_text(author['name'])
-            entry = opds.create_navigation_entry(
-                f"{safe_name} ({author['book_count']} 本书)",
-                f"/opds/books?author={quote(safe_name)}",
-                f"作者: {safe_name}"
-            )
-            entries.append(entry)
+        links = []
+        if len(items) == limit:
+            links.append({
+                'rel': 'next',
+                'href': f"{opds.base_url}/opds/{kind}?limit={limit}&after={items[-1][0]}",
+                'title': '下一页'
+            })
         
-        xml_content = opds.create_feed(f'按作者分类 - 第 {offset//limit + 1} 页', entries)
+        title = f'按{label}分类'
+        if after is None:
+            title += f' - 第 {offset//limit + 1} 页'
+        xml_content = opds.create_feed(title, entries, links)
         return Response(xml_content, mimetype='application/atom+xml;charset=utf-8')
     except Exception as e:
-        logger.error(f"按作者分类获取失败: {e}")
+        logger.error(f"按{label}分类获取失败: {e}")
         return NotFound()
 
+@app.route('/opds/authors')
+@cached_feed(max_age=NAV_CACHE_MAX_AGE)
+def opds_authors():
+    """按作者分类的OPDS列表"""
+    return taxonomy_feed('authors', (SQL_NAV_AUTHORS, SQL_NAV_AUTHORS_AFTER), 'author', '作者')
+
 @app.route('/opds/series')
+@cached_feed(max_age=NAV_CACHE_MAX_AGE)
 def opds_series():
     """按系列分类的OPDS列表"""
-    limit = min(int(request.args.get('limit', 50)), 100)
-    offset = int(request.args.get('offset', 0))
-    
-    def _get_series():
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT DISTINCT s.name, s.sort, COUNT(b.id) as book_count
-            FROM series s
-            JOIN books_series_link bsl ON s.id = bsl.series
-            JOIN books b ON bsl.book = b.id
-            GROUP BY s.id, s.name, s.sort
-            ORDER BY s.sort
-            LIMIT ? OFFSET ?
-        """, (limit, offset))
-        return [dict(row) for row in cursor.fetchall()]
-    
-    try:
-        series = db.execute_and_log_errors(_get_series)
-        
-        opds = OPDSGenerator(base_url=request.url_root.rstrip('/'))
-        entries = []
-        
-        for serie in series:
-            safe_name = safe_convert_text(serie['name'])
-            entry = opds.create_navigation_entry(
-                f"{safe_name} ({serie['book_count']} 本书)",
-                f"/opds/books?series={quote(safe_name)}",
-                f"系列: {safe_name}"
-            )
-            entries.append(entry)
-        
-        xml_content = opds.create_feed(f'按系列分类 - 第 {offset//limit + 1} 页', entries)
-        return Response(xml_content, mimetype='application/atom+xml;charset=utf-8')
-    except Exception as e:
-        logger.error(f"按系列分类获取失败: {e}")
-        return NotFound()
+    return taxonomy_feed('series', (SQL_NAV_SERIES, SQL_NAV_SERIES_AFTER), 'series', '系列')
 
 @app.route('/opds/tags')
+@cached_feed(max_age=NAV_CACHE_MAX_AGE)
 def opds_tags():
     """按标签分类的OPDS列表"""
-    limit = min(int(request.args.get('limit', 50)), 100)
-    offset = int(request.args.get('offset', 0))
-    
-    def _get_tags():
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT DISTINCT t.name, COUNT(b.id) as book_count
-            FROM tags t
-            JOIN books_tags_link btl ON t.id = btl.tag
-            JOIN books b ON btl.book = b.id
-            GROUP BY t.id, t.name
-            ORDER BY t.name
-            LIMIT ? OFFSET ?
-        """, (limit, offset))
-        return [dict(row) for row in cursor.fetchall()]
-    
-    try:
-        tags = db.execute_and_log_errors(_get_tags)
-        
-        opds = OPDSGenerator(base_url=request.url_root.rstrip('/'))
-        entries = []
-        
-        for tag in tags:
-            safe_name = safe_convert_text(tag['name'])
-            entry = opds.create_navigation_entry(
-                f"{safe_name} ({tag['book_count']} 本书)",
-                f"/opds/books?tag={quote(safe_name)}",
-                f"标签: {safe_name}"
-            )
-            entries.append(entry)
-        
-        xml_content = opds.create_feed(f'按标签分类 - 第 {offset//limit + 1} 页', entries)
-        return Response(xml_content, mimetype='application/atom+xml;charset=utf-8')
-    except Exception as e:
-        logger.error(f"按标签分类获取失败: {e}")
-        return NotFound()
+    return taxonomy_feed('tags', (SQL_NAV_TAGS, SQL_NAV_TAGS_AFTER), 'tag', '标签')
 
 @app.route('/opds/book/<int:book_id>')
 def opds_book_detail(book_id):
-    """书籍详情"""
+    """
+    书籍详情
+    ETag由feed缓存按内容计算；Last-Modified取自书籍自身的修改时间，
+    客户端只带If-Modified-Since复查且书籍未修改时直接返回304，不查询详情也不生成XML
+    （带If-None-Match时以ETag为准，交给cached_feed判断）
+    """
+    last_modified = db.get_book_last_modified(book_id)
+    if last_modified is None:
+        return NotFound()
+    
+    if 'If-None-Match' not in request.headers and \
+            not is_resource_modified(request.environ, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        response = render_book_detail(book_id)
+        if not isinstance(response, Response):
+            return response
+    response.last_modified = last_modified
+    return response
+
+@cached_feed
+def render_book_detail(book_id):
+    """生成书籍详情feed"""
     book = db.get_book_detail(book_id)
     if not book:
         return NotFound()
     
-    opds = OPDSGenerator(base_url=request.url_root.rstrip('/'))
-    entries = [book] if book else []
-    xml_content = opds.create_feed(f'书籍详情: {book["title"]}', entries)
+    xml_content = get_opds().create_feed(f'书籍详情: {book["title"]}', [book])
     return Response(xml_content, mimetype='application/atom+xml;charset=utf-8')
 
+def offload_file(response, file_path):
+    """
+    X-Accel-Redirect模式下，把send_file生成的X-Sendfile头换成nginx内部路径
+    文件内容由nginx通过sendfile(2)直接从页缓存发送，不经过Python
+    """
+    if OPDS_ACCEL_REDIRECT_PREFIX and 'X-Sendfile' in response.headers:
+        del response.headers['X-Sendfile']
+        rel_path = os.path.relpath(file_path, os.path.abspath(db.base_books_path)).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = f"{OPDS_ACCEL_REDIRECT_PREFIX}/{quote(rel_path)}"
+    return response
+
+# 封面文件名及MIME类型，按优先级排列
+_COVER_FILES = types.MappingProxyType({
+    'cover.jpg': 'image/jpeg', 'cover.jpeg': 'image/jpeg', 'cover.png': 'image/png'
+})
+
+@functools.lru_cache(maxsize=4096)
+def _scan_cover(book_dir, dir_mtime_ns):
+    """单次scandir查找封面；目录修改时间作为缓存键的一部分，封面增删后自动失效"""
+    found = {}
+    try:
+        with os.scandir(book_dir) as it:
+            for entry in it:
+                name = entry.name.lower()
+                # DirEntry.is_file()使用readdir返回的d_type，无需额外stat
+                if name in _COVER_FILES and entry.is_file():
+                    found[name] = entry.path
+    except OSError:
+        return None
+    for name, mime_type in _COVER_FILES.items():
+        if name in found:
+            return found[name], mime_type
+    return None
+
+def resolve_cover(book_dir):
+    """返回 (封面路径, MIME类型)，没有封面时返回None"""
+    try:
+        dir_mtime_ns = os.stat(book_dir).st_mtime_ns
+    except OSError:
+        return None
+    return _scan_cover(book_dir, dir_mtime_ns)
+
 @app.route('/opds/cover/<int:book_id>')
 def get_cover(book_id):
     """获取书籍封面"""
@@ -945,35 +1595,46 @@ def get_cover(book_id):
         if not book or not book.get('path'):
             return NotFound("Book or path not found")
         
-        base_path = db.base_books_path
         book_path = book['path'].replace('\\', '/')
+        cover = resolve_cover(os.path.join(db.base_books_path, book_path))
+        if cover is None:
+            return NotFound("Cover not found")
         
-        cover_extensions = ['.jpg', '.png']
-        
-        for ext in cover_extensions:
-            cover_filename = f'cover{ext}'
-            cover_path = os.path.join(base_path, book_path, cover_filename)
-            
-            if os.path.exists(cover_path):
-                if ext.lower() == '.png':
-                    mime_type = 'image/png'
-                elif ext.lower() in ['.jpg', '.jpeg']:
-                    mime_type = 'image/jpeg'
-                else:
-                    mime_type = 'image/jpeg'
-                
-                return send_file(cover_path, mimetype=mime_type)
-        
-        return NotFound("Cover not found")
+        cover_path = Path(cover[0]).absolute()
+        # 传入路径而非文件对象，WSGI服务器可通过wsgi.file_wrapper使用sendfile零拷贝发送；
+        # 封面很少变化，允许客户端缓存一天并以304响应重复请求
+        response = send_file(cover_path, mimetype=cover[1], conditional=True, max_age=86400)
+        return offload_file(response, str(cover_path))
         
     except Exception as e:
         logger.error(f"获取封面失败: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 # --- 文件服务路由 (下载) ---
+def iter_book_files(book_dir, db_filename, ext):
+    """
+    按优先级逐个产出下载文件的候选路径
+    1. 数据库中的原始文件名；2. 补上扩展名（Calibre的data.name不含扩展名）；
+    3. 前两者都不存在时才扫描目录，取第一个同扩展名的文件
+    """
+    yield os.path.join(book_dir, db_filename)
+    if not ext:
+        return
+    if not db_filename.lower().endswith(ext):
+        yield os.path.join(book_dir, db_filename + ext)
+    try:
+        with os.scandir(book_dir) as it:
+            found = next((entry.path for entry in it
+                          if entry.name.lower().endswith(ext) and entry.is_file()), None)
+    except OSError:
+        return
+    if found:
+        yield found
+
 @app.route('/download/<int:book_id>/<path:filename>')
 def download_book(book_id, filename):
     """下载书籍 - 文石优化版本"""
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
     try:
         book = db.get_book_detail(book_id)
         if not book:
@@ -982,7 +1643,6 @@ def download_book(book_id, filename):
         
         # 从文件名中提取格式（标准格式：/download/{book_id}/{format}）
         requested_format = filename.upper()
-        base_filename = None
         
         # 查找匹配的格式
         target_format = None
@@ -1001,42 +1661,18 @@ def download_book(book_id, filename):
         book_path = book['path'].replace('\\', '/')
         db_filename = target_format['filename']
         
-        # 尝试多个可能的文件路径
-        possible_files = []
-        
-        # 1. 数据库中的原始文件名
-        possible_files.append(os.path.join(base_path, book_path, db_filename))
-        
-        # 2. 添加扩展名
-        format_extension_map = {
-            'EPUB': '.epub', 'PDF': '.pdf', 'MOBI': '.mobi',
-            'AZW3': '.azw3', 'FB2': '.fb2', 'RTF': '.rtf',
-            'TXT': '.txt', 'HTML': '.html', 'LIT': '.lit'
-        }
-        ext = format_extension_map.get(target_format['format'].upper(), '')
-        if ext and not db_filename.lower().endswith(ext.lower()):
-            possible_files.append(os.path.join(base_path, book_path, db_filename + ext))
-        
-        # 3. 如果URL中包含文件名，尝试精确匹配
-        if base_filename:
-            possible_files.append(os.path.join(base_path, book_path, base_filename + ext))
-        
-        # 4. 查找目录中匹配的文件
         book_dir = os.path.join(base_path, book_path)
-        if os.path.exists(book_dir):
-            for file in os.listdir(book_dir):
-                file_lower = file.lower()
-                if ext and file_lower.endswith(ext.lower()):
-                    possible_files.append(os.path.join(book_dir, file))
-                if base_filename and file_lower.startswith(base_filename.lower()):
-                    possible_files.append(os.path.join(book_dir, file))
-        
-        # 查找存在的文件
+        # requested_format已是大写且与匹配到的格式相同，扩展名和MIME类型都直接用它查表（表中扩展名均为小写）
+        ext = _FORMAT_EXT.get(requested_format, '')
+        
+        # 候选路径按需生成，找到第一个存在的文件即停止
+        possible_files = []
         full_path = None
-        for path in possible_files:
-            normalized_path = os.path.normpath(path)
-            if os.path.exists(normalized_path):
-                full_path = normalized_path
+        for path in iter_book_files(book_dir, db_filename, ext):
+            path = os.path.normpath(path)
+            possible_files.append(path)
+            if os.path.isfile(path):
+                full_path = path
                 break
         
         if not full_path:
@@ -1046,31 +1682,28 @@ def download_book(book_id, filename):
         logger.info(f"成功找到文件，开始下载: {os.path.basename(full_path)}, 大小: {os.path.getsize(full_path)} 字节")
         
         # 获取MIME类型
-        temp_opds = OPDSGenerator(base_url=request.url_root.rstrip('/'))
-        mime_type = temp_opds.get_mime_type(target_format['format'])
+        mime_type = _MIME_TYPES.get(requested_format, 'application/octet-stream')
         
         # 使用数据库中的书名生成下载文件名
         book_title = book.get('title', '未知书籍')
-        logger.debug(f"原始书名: {repr(book_title)}")
+        if debug_enabled:
+            logger.debug(f"原始书名: {repr(book_title)}")
         
-        format_extension = {
-            'EPUB': '.epub', 'PDF': '.pdf', 'MOBI': '.mobi',
-            'AZW3': '.azw3', 'FB2': '.fb2', 'RTF': '.rtf',
-            'TXT': '.txt', 'HTML': '.html', 'LIT': '.lit'
-        }.get(target_format['format'].upper(), '.epub')
+        format_extension = ext or '.epub'
         
         # 生成安全的中文文件名
         safe_title = safe_convert_text(book_title)
-        logger.debug(f"转换后书名: {repr(safe_title)}")
+        if debug_enabled:
+            logger.debug(f"转换后书名: {repr(safe_title)}")
         
         # 确保原始书名不为空
         if not safe_title or safe_title.strip() == "":
             logger.warning(f"书名为空，使用默认文件名")
             safe_filename = f"书籍_{book_id}{format_extension}"
         else:
-            safe_filename = re.sub(r'[<>:"/\\|?*]', '', safe_title)
-            safe_filename = safe_filename.replace(' ', '_')
-            logger.debug(f"处理后文件名: {repr(safe_filename)}")
+            safe_filename = _UNSAFE_FN_RE.sub('', safe_title).translate(_SPACE_TR)
+            if debug_enabled:
+                logger.debug(f"处理后文件名: {repr(safe_filename)}")
             
             if not safe_filename.lower().endswith(format_extension.lower()):
                 safe_filename += format_extension
@@ -1079,12 +1712,16 @@ def download_book(book_id, filename):
             base_name = os.path.splitext(safe_filename)[0]
             if not base_name or base_name == format_extension or len(base_name.strip()) == 0:
                 safe_filename = f"书籍_{book_id}{format_extension}"
-                logger.debug(f"触发fallback机制，使用默认文件名: {safe_filename}")
+                if debug_enabled:
+                    logger.debug(f"触发fallback机制，使用默认文件名: {safe_filename}")
         
-        logger.debug(f"最终文件名: {repr(safe_filename)}")
+        if debug_enabled:
+            logger.debug(f"最终文件名: {repr(safe_filename)}")
         
         try:
             # 设置响应头 - 使用更安全的方式
+            # 使用绝对路径，相对路径会被Flask按应用目录解析
+            full_path = os.path.abspath(full_path)
             response = send_file(
                 full_path,
                 as_attachment=True,
@@ -1099,6 +1736,7 @@ def download_book(book_id, filename):
             # 添加缓存控制头
             response.headers['Cache-Control'] = 'public, max-age=3600'
             response.headers['X-Content-Type-Options'] = 'nosniff'
+            offload_file(response, full_path)
             
             logger.info(f"下载文件: {safe_filename}")
             return response
@@ -1127,23 +1765,29 @@ def api_book_detail(book_id):
     if not book: return jsonify({'error': 'Book not found'}), 404
     return jsonify(book)
 
+def get_library_stats():
+    """
+    获取书库统计（书籍数、作者数、各格式书籍数）
+    统计信息、健康检查与诊断共用，按数据库修改时间缓存，书库未修改时监控轮询不会重新统计
+    """
+    def _get_stats():
+        cursor = db.get_connection().cursor()
+        cursor.execute(SQL_STATS)
+        stats = {'total_books': 0, 'total_authors': 0, 'formats': {}}
+        for kind, format_name, count in cursor.fetchall():
+            if kind == 'format':
+                stats['formats'][format_name] = count
+            else:
+                stats[f'total_{kind}'] = count
+        return stats
+    
+    return cached_query('stats', (), _get_stats)
+
 @app.route('/api/stats')
 def api_stats():
     """获取统计信息"""
-    def _get_stats():
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM books")
-        total_books = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM authors")
-        total_authors = cursor.fetchone()[0]
-        cursor.execute("SELECT format, COUNT(*) FROM data GROUP BY format")
-        format_stats = dict(cursor.fetchall())
-        return {'total_books': total_books, 'total_authors': total_authors, 'formats': format_stats}
-    
     try:
-        stats = db.execute_and_log_errors(_get_stats)
-        return jsonify(stats)
+        return jsonify(get_library_stats())
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -1161,9 +1805,7 @@ def api_health():
                 'timestamp': datetime.now(timezone.utc).isoformat()
             }), 503
         
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM books")
-        book_count = cursor.fetchone()[0]
+        book_count = get_library_stats()['total_books']
         
         return jsonify({
             'status': 'healthy',
@@ -1207,9 +1849,7 @@ def api_diagnose():
         # 测试数据库连接
         try:
             conn = db.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM books")
-            book_count = cursor.fetchone()[0]
+            book_count = get_library_stats()['total_books']
             tests['database'] = {
                 'status': 'ok',
                 'book_count': book_count,
@@ -1318,4 +1958,8 @@ if __name__ == '__main__':
     logger.info(f"OPDS目录: http://{host}:{port}/opds")
     logger.info(f"数据库路径: {db.db_path}")
     logger.info(f"书籍路径: {db.base_books_path}")
-    app.run(host=host, port=port, debug=True)
\ No newline at end of file
+    if OPDS_DEBUG:
+        logger.warning("调试模式已开启（OPDS_DEBUG=true），请勿用于生产环境")
+    else:
+        logger.info("生产环境请使用: gunicorn -c gunicorn_conf.py opds_server:app")
+    app.run(host=host, port=port, debug=OPDS_DEBUG, threaded=True)
\ No newline at end of file